@@ -67,12 +67,62 @@ function vimcord#buffer#append(message, reply, extra, highlighted)
   call setline(line_number + 1, new_lines)
   call extend(b:vimcord_lines_to_messages, repeat([message_number], new_line_count))
 
+  call s:add_message_extmarks(line_number, a:reply, a:highlighted)
+
+  setlocal nomodifiable
+  " BUFFER NOT MODIFIABLE
+endfunction
+
+" Insert messages above all others in the buffer. Each message is a List of
+" the arguments to vimcord#buffer#append, and they are kept in the order given.
+" Message numbers already in the buffer are shifted by the number of messages.
+function vimcord#buffer#prepend(messages)
+  if len(b:vimcord_lines_to_messages) ==# 0
+    for message in a:messages
+      call call("vimcord#buffer#append", message)
+    endfor
+    return
+  endif
+
+  " BUFFER MODIFIABLE
+  setlocal modifiable
+
+  let new_message_count = len(a:messages)
+  let new_lines = []
+  let new_lines_to_messages = []
+  let new_extra_data = []
+  let extmarks = []
+  for message_number in range(new_message_count)
+    let [message, reply, extra, highlighted] = a:messages[message_number]
+    call add(new_extra_data, extra)
+    call add(extmarks, [len(new_lines), reply, highlighted])
+
+    call extend(new_lines, map(message, { k, v ->
+          \ (repeat(" ", k == 0 ? 0 : g:vimcord_shift_width)) . v
+          \ }))
+    call extend(new_lines_to_messages, repeat([message_number], len(message)))
+  endfor
+
+  call append(0, new_lines)
+  let b:vimcord_lines_to_messages = new_lines_to_messages +
+        \ map(b:vimcord_lines_to_messages, { _, v -> v + new_message_count })
+  let b:vimcord_messages_to_extra_data = new_extra_data + b:vimcord_messages_to_extra_data
+
+  for [line_number, reply, highlighted] in extmarks
+    call s:add_message_extmarks(line_number, reply, highlighted)
+  endfor
+
+  setlocal nomodifiable
+  " BUFFER NOT MODIFIABLE
+endfunction
+
+function s:add_message_extmarks(line_number, reply, highlighted)
   if len(a:reply) > 0
     call insert(a:reply, [" ╓─", "vimcordReply"], 0)
     call nvim_buf_set_extmark(
           \ 0,
           \ luaeval("vimcord.REPLY_NAMESPACE"),
-          \ line_number,
+          \ a:line_number,
           \ 0,
           \ { "virt_lines": [a:reply], "virt_lines_above": v:true }
           \ )
@@ -82,14 +132,11 @@ function vimcord#buffer#append(message, reply, extra, highlighted)
     call nvim_buf_set_extmark(
           \ 0,
           \ luaeval("vimcord.HIGHLIGHT_NAMESPACE"),
-          \ line_number,
+          \ a:line_number,
           \ 0,
           \ { "end_col": 1, "hl_group": "VimcordHighlight" }
           \ )
   endif
-
-  setlocal nomodifiable
-  " BUFFER NOT MODIFIABLE
 endfunction
 
 function vimcord#buffer#edit(message_number, message, extra, highlighted)
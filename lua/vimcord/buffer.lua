@@ -49,6 +49,11 @@ function buffer.append_messages_to_buffer(messages)
   end
 end
 
+-- older messages, which go above all the others
+function buffer.prepend_messages_to_buffer(messages)
+  vim.call("vimcord#buffer#prepend", messages)
+end
+
 function buffer.edit_buffer_message(message_number, message_content, extra, highlighted)
   local total_lines = vim.call("line", "$")
 
@@ -62,6 +62,7 @@ end
 discord = {
   create_window=create_window,
   append_messages_to_buffer=wrap_discord(buffer.append_messages_to_buffer),
+  prepend_messages_to_buffer=wrap_discord(buffer.prepend_messages_to_buffer),
   edit_buffer_message=wrap_discord(edit_buffer_message, true),
   delete_buffer_message=wrap_discord(delete_buffer_message, true),
   add_link_extmarks=wrap_discord(buffer.add_link_extmarks, true),
@@ -5,6 +5,8 @@ import time
 
 import vimcord.discord as discord
 import vimcord.local_discord_server as local_discord_server
+from vimcord.local_discord_server.replication import StateMirror
+from vimcord.pickle_pipe import PicklePipeException, ForwardedException
 from vimcord.formatting import format_channel, clean_post, extmark_post
 from vimcord.links import get_link_content, LINK_RE
 
@@ -20,6 +22,13 @@ def utc_timestamp_to_iso(timestamp):
     iso_format[1] = iso_format[1].split("+")[0].split("-")[0]
     return " ".join(iso_format)
 
+def vim_id(discord_id):
+    '''
+    Convert a Discord ID to send to vim.
+    IDs are always sent as strings, since Lua numbers cannot hold every snowflake.
+    '''
+    return None if discord_id is None else str(discord_id)
+
 def is_current(timestr):
     '''Retrieves whether the date encoded by the time string is in the future'''
     if isinstance(timestr, int) and timestr < 0 or timestr is None:
@@ -43,19 +52,74 @@ class DiscordBridge:
         self.visited_links = set()
 
         # server properties that need refreshed rarely, but get used for unmuted channels/is muted
-        self._user = None
-        self._dm_ordering = {}
-        self._notify = {}
-        self._servers = []
-        self._private_channels = []
+        # kept up-to-date by deltas from the daemon
+        self.state = StateMirror()
+        # older daemons do not send snapshots or deltas, so everything must be refetched
+        self._snapshot_supported = True
+
+    @property
+    def _user(self):
+        return self.state.user
+
+    @property
+    def _dm_ordering(self):
+        return self.state.dm_ordering
+
+    @property
+    def _notify(self):
+        return self.state.notify
+
+    @property
+    def _servers(self):
+        return self.state.servers
+
+    @property
+    def _private_channels(self):
+        return self.state.private_channels
+
+    def _remote_attribute_calls(self):
+        '''Calls for `wait_for_many` which get the members refreshed by `get_remote_attributes`'''
+        call = self.discord_pipe.call
+        if self._snapshot_supported:
+            return [call.state_snapshot()]
+        return [
+            call.user(),
+            call._dm_ordering(),
+            call._notify(),
+            call.servers(),
+            call.private_channels(),
+        ]
+
+    async def _fetch_with_remote_attributes(self, *calls):
+        '''
+        Refresh rarely-updated members from the daemon, along with the results
+        of `calls` in the same round trip. Returns the results of `calls`.
+        '''
+        remote_calls = self._remote_attribute_calls()
+        results = await self.discord_pipe.wait_for_many(
+            *remote_calls,
+            *calls,
+            return_exceptions=True
+        )
+        if self._snapshot_supported and isinstance(results[0], PicklePipeException):
+            log.info("Daemon does not send state deltas; falling back to refetching state")
+            self._snapshot_supported = False
+            self.discord_pipe.event("remote_update", self.on_remote_update)
+            return await self._fetch_with_remote_attributes(*calls)
+
+        for result in results:
+            if isinstance(result, (PicklePipeException, ForwardedException)):
+                raise result
+
+        if self._snapshot_supported:
+            self.state.load(*results[0])
+        else:
+            self.state.load(None, *results[:len(remote_calls)])
+        return results[len(remote_calls):]
 
     async def get_remote_attributes(self):
         '''Refresh rarely-updated members from the daemon'''
-        self._user = await self.discord_pipe.awaitable.user()
-        self._dm_ordering = await self.discord_pipe.awaitable._dm_ordering()
-        self._notify = await self.discord_pipe.awaitable._notify()
-        self._servers = await self.discord_pipe.awaitable.servers()
-        self._private_channels = await self.discord_pipe.awaitable.private_channels()
+        await self._fetch_with_remote_attributes()
 
     async def resolve_author_dm(self, post):
         if not isinstance(post, discord.Message):
@@ -65,36 +129,51 @@ class DiscordBridge:
         channel_id, _ = await self.discord_pipe.awaitable._resolve_destination(post.author)
         # fetch the new private channel if we don't have it
         if not any(i.id == channel_id for i in self._private_channels):
-            self._private_channels = await self.discord_pipe.awaitable.private_channels()
+            self.state.private_channels = await self.discord_pipe.awaitable.private_channels()
         return channel_id
 
     async def start_discord_client_server(self, path, discord_username, discord_password):
         '''Spawn a local discord server as a daemon and set the discord pipe object'''
-        if self.discord_pipe is None:
+        resumed = False
+        if self.discord_pipe is None or self.discord_pipe.transport is None:
             log.info("Starting client %s", path)
+            # if the pipe was lost, pick up where it left off
+            position = self.discord_pipe.journal_position if self.discord_pipe is not None else None
             # TODO: set discord_ready here
             _, self.discord_pipe = await local_discord_server.connect_to_daemon(path, log)
 
             # bind events
-            self.discord_pipe.event("remote_update", self.on_remote_update)
+            # remote_update repeats every state delta, so it is only needed by
+            # daemons which do not send deltas
+            if not self._snapshot_supported:
+                self.discord_pipe.event("remote_update", self.on_remote_update)
+            self.discord_pipe.event("state_delta", self.on_state_delta)
             self.discord_pipe.event("servers_ready", self.on_ready)
             self.discord_pipe.event("message", self.on_message)
             self.discord_pipe.event("message_edit", self.on_message_edit)
             self.discord_pipe.event("message_delete", self.on_message_delete)
             self.discord_pipe.event("dm_update", self.on_dm_update)
             self.discord_pipe.event("error", self.on_error)
+
+            resumed = await self.discord_pipe.resume(position)
+            if resumed:
+                log.info("Replayed events missed since %s", position)
         else:
             log.info("Using existing client")
 
-        await self.preamble(discord_username, discord_password)
+        await self.preamble(discord_username, discord_password, resumed)
 
-    async def preamble(self, discord_username, discord_password):
+    async def preamble(self, discord_username, discord_password, resumed=False):
         '''
         When connecting to the daemon, check if the user is logged in and
         whether a connection has been established.
+        If the daemon replayed everything missed since the last connection
+        (`resumed`), the messages already in the buffer are kept.
         '''
-        is_logged_in = await self.discord_pipe.awaitable.is_logged_in()
-        is_not_connected = await self.discord_pipe.awaitable.is_closed()
+        is_logged_in, is_not_connected = await self.discord_pipe.wait_for_many(
+            self.discord_pipe.call.is_logged_in(),
+            self.discord_pipe.call.is_closed(),
+        )
         if not is_logged_in:
             log.info("Not logged in! Attempting to login and start discord connection...")
             self.discord_pipe.task.start(
@@ -105,7 +184,7 @@ class DiscordBridge:
             if is_not_connected:
                 log.info("Not connected to discord! Attempting to reconnect...")
                 self.discord_pipe.task.connect()
-            else:
+            elif not resumed:
                 self.plugin.nvim.loop.create_task(self.on_ready())
 
         self.plugin.nvim.async_call(
@@ -115,28 +194,38 @@ class DiscordBridge:
         )
 
     async def close(self):
-        self.discord_pipe.transport.close()
+        if self.discord_pipe.transport is not None:
+            self.discord_pipe.transport.close()
+
+    def parse_id(self, value):
+        '''Convert an ID from vim to the type the daemon uses (see `vim_id`)'''
+        if value is None or not isinstance(getattr(self._user, "id", None), int):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            return value
 
     @property
     def all_members(self):
-        return {server.id: [
+        return {vim_id(server.id): [
                 member.display_name for member in server.members
             ]
             for server in self._servers}
 
     @property
     def all_channel_names(self):
-        return { i.id: format_channel(i, raw=True) for i in self.all_channels }
+        return { vim_id(i.id): format_channel(i, raw=True) for i in self.all_channels }
 
     @property
     def unmuted_channel_names(self):
-        return { i.id: format_channel(i, raw=True) for i in self.unmuted_channels }
+        return { vim_id(i.id): format_channel(i, raw=True) for i in self.unmuted_channels }
 
     @property
     def extra_data(self):
         '''Data to set in g:vimcord'''
         return {
-            "discord_user_id": self._user.id,
+            "discord_user_id": vim_id(self._user.id),
         }
 
     def get_channel_by_name(self, channel_name):
@@ -184,7 +273,7 @@ class DiscordBridge:
 
         self.plugin.nvim.async_call(
             lambda x,y,z,w: self.plugin.nvim.lua.vimcord.discord.add_link_extmarks(x,y,z,w),
-            message_id,
+            vim_id(message_id),
             extmark_content,
             media_links,
             [link for link in links if link in self.visited_links]
@@ -195,26 +284,23 @@ class DiscordBridge:
         log.info("Getting new remote")
         await self.get_remote_attributes()
 
+    async def on_state_delta(self, version, kind, op, key, value):
+        if not self.state.apply(version, kind, op, key, value):
+            log.info("Missed a state delta; getting a new snapshot")
+            await self.get_remote_attributes()
+
     async def on_ready(self):
-        '''Ready callback. Get messages from daemon and add them to the buffer'''
+        '''
+        Ready callback. Get messages from daemon and add them to the buffer.
+        Messages arrive in pages, newest first, so that the newest can be shown
+        while older ones are still on their way.
+        '''
         # TODO: seems to fail when sent over again
-        await self.get_remote_attributes()
         log.info("Retrieving messages from daemon")
-        start_messages = await self.discord_pipe.awaitable.connection.messages()
-        unmuted_messages = [message
-            for message in start_messages
-            if not self.is_muted(
-                getattr(message, "server", None),
-                message.channel
-            )]
-
-        links_and_messages = [
-            self._prepare_post_for_buffer(message)
-            for message in unmuted_messages
-        ]
-
-        is_logged_in = await self.discord_pipe.awaitable.is_logged_in()
-        is_not_connected = await self.discord_pipe.awaitable.is_closed()
+        is_logged_in, is_not_connected = await self._fetch_with_remote_attributes(
+            self.discord_pipe.call.is_logged_in(),
+            self.discord_pipe.call.is_closed(),
+        )
 
         def on_ready_callback():
             log.info("Sending data to vim...")
@@ -229,28 +315,78 @@ class DiscordBridge:
                 [True, is_not_connected, is_logged_in]
             )
 
-            if not links_and_messages:
-                return
+        self.plugin.nvim.async_call(on_ready_callback)
 
-            id_and_links, unflat_messages = zip(*links_and_messages)
-            # send messages to vim
-            self.plugin.nvim.lua.vimcord.discord.append_messages_to_buffer(
-                [message for i in unflat_messages for message in i]
-            )
+        earliest_post = None
+        try:
+            channel_ids = [channel.id for channel in self.unmuted_channels]
+            async for page in self.discord_pipe.stream.messages_newest_first(channel_ids):
+                earliest_post = self._add_backlog_page(page, earliest_post)
+        except (PicklePipeException, ForwardedException):
+            if earliest_post is not None:
+                raise
+            # older daemons cannot stream messages, or filter them by channel
+            start_messages = await self.discord_pipe.awaitable.connection.messages()
+            self._add_backlog_page(start_messages[::-1], None)
+
+    def _add_backlog_page(self, page, earliest_post):
+        '''
+        Add a page of messages from the backlog (newest first) to the buffer.
+        The first page is appended. Later pages are older than `earliest_post`,
+        the earliest message already added, so they go above everything else.
+        Returns the earliest message added so far.
+        '''
+        posts = [message
+            for message in reversed(page)
+            if message.id not in self.all_messages and not self.is_muted(
+                getattr(message, "server", None),
+                message.channel
+            )]
+        if not posts:
+            return earliest_post
 
-            # start link fetches
-            if not self.plugin.do_link_previews:
-                return
+        if earliest_post is None:
+            links_and_messages = [self._prepare_post_for_buffer(post) for post in posts]
+        else:
+            links_and_messages = self._prepare_older_posts(posts, earliest_post)
 
-            for message_id, links in id_and_links:
-                if not links:
-                    continue
-                self.plugin.nvim.loop.create_task(
-                    self.add_link_extmarks(message_id, links)
-                )
+        self.plugin.nvim.async_call(
+            self._add_backlog_to_buffer,
+            links_and_messages,
+            earliest_post is not None
+        )
+        return posts[0]
+
+    def _prepare_older_posts(self, posts, following_post):
+        '''Prepare posts which go above `following_post`, without changing the last post'''
+        last_post = self._last_post
+        self._last_post = None
+        links_and_messages = [self._prepare_post_for_buffer(post) for post in posts]
+        # the first post already added had nothing before it, so it has no channel header
+        if self._last_post.channel != following_post.channel:
+            links_and_messages.append(((None, []), [self._channel_header(following_post)]))
+        self._last_post = last_post
+        return links_and_messages
+
+    def _add_backlog_to_buffer(self, links_and_messages, older):
+        id_and_links, unflat_messages = zip(*links_and_messages)
+        messages = [message for i in unflat_messages for message in i]
+        # send messages to vim
+        if older:
+            self.plugin.nvim.lua.vimcord.discord.prepend_messages_to_buffer(messages)
+        else:
+            self.plugin.nvim.lua.vimcord.discord.append_messages_to_buffer(messages)
 
+        # start link fetches
+        if not self.plugin.do_link_previews:
+            return
 
-        self.plugin.nvim.async_call(on_ready_callback)
+        for message_id, links in id_and_links:
+            if not links:
+                continue
+            self.plugin.nvim.loop.create_task(
+                self.add_link_extmarks(message_id, links)
+            )
 
     async def on_message(self, post):
         '''Add message to the buffer if it has not been muted'''
@@ -271,19 +407,23 @@ class DiscordBridge:
                 self.add_link_extmarks(message_id, links)
             )
 
+    def _channel_header(self, post):
+        '''Buffer lines which introduce the channel of `post`'''
+        return (
+            [format_channel(post.channel)],
+            [],
+            {
+                "channel_id": vim_id(post.channel.id),
+                "server_id":  vim_id(post.server.id if post.server is not None else None),
+            },
+            False,
+        )
+
     def _prepare_post_for_buffer(self, post):
         '''On message callback, when vim is available'''
         ret = []
         if self._last_post is not None and self._last_post.channel != post.channel:
-            ret.append((
-                [format_channel(post.channel)],
-                [],
-                {
-                    "channel_id": post.channel.id,
-                    "server_id":  (post.server.id if post.server is not None else None),
-                },
-                False,
-            ))
+            ret.append(self._channel_header(post))
         last_author = None if self._last_post is None or self._last_post.channel != post.channel else self._last_post.author
 
         links, reply, message = clean_post(self, post, last_author=last_author)
@@ -294,10 +434,10 @@ class DiscordBridge:
             message.split("\n") or [""],
             reply,
             {
-                "message_id": post.id,
-                "channel_id": post.channel.id,
-                "server_id":  (post.server.id if post.server is not None else None),
-                "reply_message_id": (post.referenced_message.id if post.referenced_message is not None else None),
+                "message_id": vim_id(post.id),
+                "channel_id": vim_id(post.channel.id),
+                "server_id":  vim_id(post.server.id if post.server is not None else None),
+                "reply_message_id": vim_id(post.referenced_message.id if post.referenced_message is not None else None),
                 "timestamp": utc_timestamp_to_iso(post.timestamp)
             },
             self._user.id in [i.id for i in post.mentions],
@@ -308,8 +448,10 @@ class DiscordBridge:
 
         return (post.id, links), ret
 
-    async def on_message_edit(self, _, post):
+    async def on_message_edit(self, *posts):
         '''If a message was edited, update the buffer'''
+        # older daemons also send the message from before the edit
+        post = posts[-1]
         muted = self.is_muted(getattr(post, "server", None), post.channel)
         if muted:
             return
@@ -324,15 +466,15 @@ class DiscordBridge:
         links, _, message = clean_post(self, post, no_reply=True, last_author=last_author)
         as_reply = extmark_post(self, post)
         self.plugin.nvim.lua.vimcord.discord.edit_buffer_message(
-            post.id,
+            vim_id(post.id),
             as_reply,
             message.split("\n"),
             # this is immutable data, but it's (marginally) easier to send it again
             {
-                "message_id": post.id,
-                "channel_id": post.channel.id,
-                "server_id":  (post.server.id if post.server is not None else None),
-                "reply_message_id": (post.referenced_message.id if post.referenced_message is not None else None),
+                "message_id": vim_id(post.id),
+                "channel_id": vim_id(post.channel.id),
+                "server_id":  vim_id(post.server.id if post.server is not None else None),
+                "reply_message_id": vim_id(post.referenced_message.id if post.referenced_message is not None else None),
             },
             self._user.id in [i.id for i in post.mentions],
         )
@@ -350,7 +492,7 @@ class DiscordBridge:
             return
         self.plugin.nvim.async_call(
             lambda x: self.plugin.nvim.lua.vimcord.discord.delete_buffer_message(x),
-            post.id,
+            vim_id(post.id),
         )
 
     async def on_dm_update(self, dm):
@@ -401,7 +543,7 @@ class DiscordBridge:
         '''Get a list of channels (and private messages)'''
         ret = [[*sorted(
             self._private_channels,
-            key=lambda x: self._dm_ordering.get(x.id, "") or "",
+            key=lambda x: int(self._dm_ordering.get(x.id) or 0),
             reverse=True
         )]]
         for server in self._servers:
@@ -109,10 +109,10 @@ class GroupCall:
         lookup = {u.id: u for u in self.call.channel.recipients}
         me = self.call.channel.me
         lookup[me.id] = me
-        self.ringing = list(filter(None, map(lambda i: lookup.get(i), kwargs.get('ringing', []))))
+        self.ringing = list(filter(None, map(lambda i: lookup.get(utils.snowflake(i)), kwargs.get('ringing', []))))
 
     def _update_voice_state(self, data):
-        user_id = data['user_id']
+        user_id = utils.snowflake(data['user_id'])
         # left the voice channel?
         if data['channel_id'] is None:
             self._voice_states.pop(user_id, None)
@@ -37,7 +37,7 @@ class Overwrites:
     __slots__ = ('id', 'allow', 'deny', 'type')
 
     def __init__(self, **kwargs):
-        self.id = kwargs.pop('id')
+        self.id = utils.snowflake(kwargs.pop('id'))
         self.allow = kwargs.pop('allow', 0)
         self.deny = kwargs.pop('deny', 0)
         self.type = kwargs.pop('type')
@@ -111,7 +111,7 @@ class Channel(Hashable):
     def _update(self, **kwargs):
         self.name = kwargs.get('name')
         self.server = kwargs.get('server')
-        self.id = kwargs.get('id')
+        self.id = utils.snowflake(kwargs.get('id'))
         self.topic = kwargs.get('topic')
         self.is_private = False
         self.position = kwargs.get('position')
@@ -128,7 +128,7 @@ class Channel(Hashable):
         everyone_id = self.server.id
 
         for index, overridden in enumerate(kwargs.get('permission_overwrites', [])):
-            overridden_id = overridden['id']
+            overridden_id = utils.snowflake(overridden['id'])
             self._permission_overwrites.append(Overwrites(**overridden))
 
             if overridden.get('type') == 'member':
@@ -147,6 +147,16 @@ class Channel(Hashable):
         if tmp:
             tmp[everyone_index], tmp[0] = tmp[0], tmp[everyone_index]
 
+    def _transfer_stub(self, server):
+        """Returns a copy of the channel which belongs to a stub of its server,
+        without voice members or permission overwrites.
+        See :meth:`Server._transfer_stub`."""
+        ret = copy.copy(self)
+        ret.server = server
+        ret.voice_members = []
+        ret._permission_overwrites = []
+        return ret
+
     @property
     def changed_roles(self):
         """Returns a list of :class:`Roles` that have been overridden from
@@ -372,19 +382,24 @@ class PrivateChannel(Hashable):
 
     __slots__ = ['id', 'recipients', 'type', 'owner', 'icon', 'name', 'me']
 
-    def __init__(self, me, **kwargs):
-        self.recipients = [User(**u) for u in kwargs['recipients']]
-        self.id = kwargs['id']
+    def __init__(self, me, users=None, **kwargs):
+        make_user = (lambda data: User(**data)) if users is None else users.get
+        self.recipients = [make_user(u) for u in kwargs['recipients']]
+        self.id = utils.snowflake(kwargs['id'])
         self.me = me
         self.type = ChannelType(kwargs['type'])
         self._update_group(**kwargs)
 
     def _update_group(self, **kwargs):
-        owner_id = kwargs.get('owner_id')
+        owner_id = utils.snowflake(kwargs.get('owner_id'))
         self.icon = kwargs.get('icon')
         self.name = kwargs.get('name')
         self.owner = utils.find(lambda u: u.id == owner_id, self.recipients)
 
+    def _transfer_stub(self, server=None):
+        """Private channels only refer to users, so they are sent as-is."""
+        return self
+
     @property
     def is_private(self):
         return True
@@ -44,6 +44,7 @@ from .iterators import LogsFromIterator
 from .gateway import *
 from .emoji import Emoji
 from .http import HTTPClient
+from .waiters import WaiterRegistry
 
 import asyncio
 import aiohttp
@@ -85,7 +86,6 @@ class Client:
 
     A number of options can be passed to the :class:`Client`.
 
-    .. _deque: https://docs.python.org/3.4/library/collections.html#collections.deque
     .. _event loop: https://docs.python.org/3/library/asyncio-eventloops.html
     .. _connector: http://aiohttp.readthedocs.org/en/stable/client_reference.html#connectors
     .. _ProxyConnector: http://aiohttp.readthedocs.org/en/stable/client_reference.html#proxyconnector
@@ -96,6 +96,28 @@ class Client:
         The maximum number of messages to store in :attr:`messages`.
         This defaults to 5000. Passing in `None` or a value less than 100
         will use the default instead of the passed in value.
+    max_messages_per_channel : Optional[int]
+        The maximum number of messages to store for any one channel.
+        Defaults to ``None``, in which case only ``max_messages`` applies.
+    channel_message_reserve : Optional[int]
+        The number of messages kept in each channel when others need room
+        in :attr:`messages`. Defaults to 0.
+    int_ids : Optional[bool]
+        Whether IDs (e.g. :attr:`Message.id`) are integers instead of strings.
+        They are converted where models and lookups read them, which makes
+        IDs smaller and faster to look up. Every client in a process must use
+        the same mode; creating one with the other raises :exc:`ClientException`.
+        Defaults to ``False``.
+    coalesce_windows : Optional[dict]
+        Maps event names (``'member_update'`` or ``'dm_update'``) to a number
+        of seconds. Repeated updates to the same member or user within that
+        time after the first are dispatched once, when it ends. The state is
+        still updated immediately. The number of merged events is counted in
+        ``connection.coalesced``. Defaults to no coalescing.
+    transport_compression : Optional[bool]
+        Whether the gateway connection is compressed as one zlib stream, which
+        shares a compression window between payloads, instead of compressing
+        large payloads one by one. Defaults to ``True``.
     loop : Optional[event loop].
         The `event loop`_ to use for asynchronous operations. Defaults to ``None``,
         in which case the default event loop is used via ``asyncio.get_event_loop()``.
@@ -124,9 +146,10 @@ class Client:
     private_channels : iterable of :class:`PrivateChannel`
         The private channels that the connected client is participating on.
     messages
-        A deque_ of :class:`Message` that the client has received from all
-        servers and private messages. The number of messages stored in this
-        deque is controlled by the ``max_messages`` parameter.
+        A :class:`MessageCache` of :class:`Message` that the client has received
+        from all servers and private messages, oldest first. The number of
+        messages stored is controlled by the ``max_messages``,
+        ``max_messages_per_channel`` and ``channel_message_reserve`` parameters.
     email
         The email used to login. This is only set if login is successful,
         otherwise it's None.
@@ -140,17 +163,25 @@ class Client:
         self.ws = None
         self.email = None
         self.loop = asyncio.get_event_loop() if loop is None else loop
-        self._listeners = []
+        self._listeners = WaiterRegistry()
+        # event name -> (handle_ method, name of on_ coroutine), built on first dispatch
+        self._handlers = None
         self.cache_auth = options.get('cache_auth', True)
         self.shard_id = options.get('shard_id')
         self.shard_count = options.get('shard_count')
+        self.transport_compression = options.get('transport_compression', True)
 
         max_messages = options.get('max_messages')
         if max_messages is None or max_messages < 100:
             max_messages = 5000
 
         self.connection = ConnectionState(self.dispatch, self.request_offline_members,
-                                          self._syncer, max_messages, loop=self.loop)
+                                          self._syncer, max_messages, loop=self.loop,
+                                          max_channel_messages=options.get('max_messages_per_channel'),
+                                          channel_message_reserve=options.get('channel_message_reserve', 0),
+                                          int_ids=options.get('int_ids', False),
+                                          wants_snapshot=self._wants_snapshot,
+                                          coalesce_windows=options.get('coalesce_windows'))
 
         connector = options.pop('connector', None)
         self.http = HTTPClient(connector, loop=self.loop)
@@ -200,56 +231,33 @@ class Client:
             pass
 
     def handle_reaction_add(self, reaction, user):
-        removed = []
-        for i, (condition, future, event_type) in enumerate(self._listeners):
-            if event_type is not WaitForType.reaction:
-                continue
-
-            if future.cancelled():
-                removed.append(i)
-                continue
-
+        for future, condition in self._listeners.waiting(WaitForType.reaction):
             try:
                 result = condition(reaction, user)
             except Exception as e:
                 future.set_exception(e)
-                removed.append(i)
             else:
                 if result:
                     future.set_result(WaitedReaction(reaction, user))
-                    removed.append(i)
-
-
-        for idx in reversed(removed):
-            del self._listeners[idx]
 
     def handle_message(self, message):
-        removed = []
-        for i, (condition, future, event_type) in enumerate(self._listeners):
-            if event_type is not WaitForType.message:
-                continue
-
-            if future.cancelled():
-                removed.append(i)
-                continue
-
+        for future, condition in self._listeners.waiting(WaitForType.message):
             try:
                 result = condition(message)
             except Exception as e:
                 future.set_exception(e)
-                removed.append(i)
             else:
                 if result:
                     future.set_result(message)
-                    removed.append(i)
-
-
-        for idx in reversed(removed):
-            del self._listeners[idx]
 
     def handle_ready(self):
         self._is_ready.set()
 
+    def handle_resumed(self):
+        # a session restored with ConnectionState.restore_session is only
+        # ready once it resumes
+        self._is_ready.set()
+
     def _resolve_invite(self, invite):
         if isinstance(invite, Invite) or isinstance(invite, Object):
             return invite.id
@@ -297,6 +305,9 @@ class Client:
         if name in ('user', 'servers', 'private_channels', 'messages', 'voice_clients'):
             return setattr(self.connection, name, value)
         else:
+            if name.startswith(('on_', 'handle_')):
+                # a handler was added or replaced, so rebuild the registry
+                object.__setattr__(self, '_handlers', None)
             object.__setattr__(self, name, value)
 
     async def _run_event(self, event, *args, **kwargs):
@@ -310,17 +321,50 @@ class Client:
             except asyncio.CancelledError:
                 pass
 
+    def _build_handlers(self):
+        handlers = {}
+        for name in dir(self):
+            if name.startswith('handle_'):
+                event = name[len('handle_'):]
+                handler, method = handlers.get(event, (None, None))
+                handlers[event] = (getattr(self, name), method)
+            elif name.startswith('on_'):
+                event = name[len('on_'):]
+                handler, method = handlers.get(event, (None, None))
+                handlers[event] = (handler, name)
+        return handlers
+
     def dispatch(self, event, *args, **kwargs):
-        log.debug('Dispatching event {}'.format(event))
-        method = 'on_' + event
-        handler = 'handle_' + event
+        handlers = self._handlers
+        if handlers is None:
+            handlers = self._handlers = self._build_handlers()
+
+        # events nothing listens to stop here
+        entry = handlers.get(event)
+        if entry is None:
+            return
 
-        if hasattr(self, handler):
-            getattr(self, handler)(*args, **kwargs)
+        log.debug('Dispatching event %s', event)
+        handler, method = entry
+        if handler is not None:
+            handler(*args, **kwargs)
 
-        if hasattr(self, method):
+        if method is not None:
             compat.create_task(self._run_event(method, *args, **kwargs), loop=self.loop)
 
+    def _wants_snapshot(self, event):
+        """Returns whether anything handling ``event`` could use the state from
+        before an update, such as the ``before`` argument of :func:`on_message_edit`.
+
+        Handlers which do not use it can set ``needs_before = False`` on themselves
+        to avoid the copy.
+        """
+        for name in ('handle_' + event, 'on_' + event):
+            handler = getattr(self, name, None)
+            if handler is not None and getattr(handler, 'needs_before', True):
+                return True
+        return False
+
     async def on_error(self, event_method, *args, **kwargs):
         """|coro|
 
@@ -418,12 +462,19 @@ class Client:
         await self.close()
         self._is_logged_in.clear()
 
-    async def connect(self):
+    async def connect(self, *, resume=False):
         """|coro|
 
         Creates a websocket connection and lets the websocket listen
         to messages from discord.
 
+        Parameters
+        -----------
+        resume : bool
+            Whether to resume the session in :attr:`connection` (e.g., one restored
+            with ``connection.restore_session``) instead of starting a new one.
+            If it cannot be resumed, a new session is started.
+
         Raises
         -------
         GatewayNotFound
@@ -432,7 +483,7 @@ class Client:
         ConnectionClosed
             The websocket connection has been terminated.
         """
-        self.ws = await DiscordWebSocket.from_client(self)
+        self.ws = await DiscordWebSocket.from_client(self, resume=resume)
 
         while not self.is_closed:
             try:
@@ -534,6 +585,23 @@ class Client:
         """bool: Indicates if the websocket connection is closed."""
         return self._closed.is_set()
 
+    @property
+    def latency(self):
+        """Optional[float]: The round trip time in seconds of the last heartbeat
+        the gateway acknowledged, or ``None`` if it has acknowledged none."""
+        if self.ws is None:
+            return None
+        return self.ws.latency
+
+    @property
+    def latencies(self):
+        """List[float]: The round trip times in seconds of the recent heartbeats
+        the gateway acknowledged, oldest first."""
+        keep_alive = getattr(self.ws, '_keep_alive', None)
+        if keep_alive is None:
+            return []
+        return list(keep_alive.latencies)
+
     # helpers/getters
 
     def get_channel(self, id):
@@ -712,7 +780,7 @@ class Client:
             return result
 
         future = asyncio.Future(loop=self.loop)
-        self._listeners.append((predicate, future, WaitForType.message))
+        self._listeners.add(WaitForType.message, future, predicate)
         try:
             message = await asyncio.wait_for(future, timeout)
         except asyncio.TimeoutError:
@@ -821,7 +889,7 @@ class Client:
             return result
 
         future = asyncio.Future(loop=self.loop)
-        self._listeners.append((predicate, future, WaitForType.reaction))
+        self._listeners.add(WaitForType.reaction, future, predicate)
         try:
             return (await asyncio.wait_for(future, timeout))
         except asyncio.TimeoutError:
@@ -890,7 +958,7 @@ class Client:
             raise InvalidArgument('user argument must be a User')
 
         data = await self.http.start_private_message(user.id)
-        channel = PrivateChannel(me=self.user, **data)
+        channel = PrivateChannel(me=self.user, users=self.connection._users, **data)
         self.connection._add_private_channel(channel)
         return channel
 
@@ -2525,9 +2593,9 @@ class Client:
             ch_id = data['channel']['id']
             channel = server.get_channel(ch_id)
         else:
-            server = Object(id=data['guild']['id'])
+            server = Object(id=utils.snowflake(data['guild']['id']))
             server.name = data['guild']['name']
-            channel = Object(id=data['channel']['id'])
+            channel = Object(id=utils.snowflake(data['channel']['id']))
             channel.name = data['channel']['name']
         data['server'] = server
         data['channel'] = channel
@@ -3105,13 +3173,13 @@ class Client:
         log.info('attempting to join voice channel {0.name}'.format(channel))
 
         def session_id_found(data):
-            user_id = data.get('user_id')
-            guild_id = data.get('guild_id')
+            user_id = utils.snowflake(data.get('user_id'))
+            guild_id = utils.snowflake(data.get('guild_id'))
             return user_id == self.user.id and guild_id == server.id
 
         # register the futures for waiting
         session_id_future = self.ws.wait_for('VOICE_STATE_UPDATE', session_id_found)
-        voice_data_future = self.ws.wait_for('VOICE_SERVER_UPDATE', lambda d: d.get('guild_id') == server.id)
+        voice_data_future = self.ws.wait_for('VOICE_SERVER_UPDATE', lambda d: utils.snowflake(d.get('guild_id')) == server.id)
 
         # request joining
         await self.ws.voice_state(server.id, channel.id)
@@ -3210,7 +3278,7 @@ class Client:
             Retrieving the information failed somehow.
         """
         data = await self.http.application_info()
-        return AppInfo(id=data['id'], name=data['name'],
+        return AppInfo(id=utils.snowflake(data['id']), name=data['name'],
                        description=data['description'], icon=data['icon'],
                        owner=User(**data['owner']))
 
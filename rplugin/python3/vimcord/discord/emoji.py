@@ -26,6 +26,7 @@ DEALINGS IN THE SOFTWARE.
 
 from . import utils
 from .mixins import Hashable
+import copy
 
 class Emoji(Hashable):
     """Represents a custom emoji.
@@ -77,13 +78,21 @@ class Emoji(Hashable):
     def _from_data(self, emoji):
         self.require_colons = emoji.get('require_colons')
         self.managed = emoji.get('managed')
-        self.id = emoji.get('id')
+        self.id = utils.snowflake(emoji.get('id'))
         self.name = emoji.get('name')
         self.roles = emoji.get('roles', [])
         if self.roles:
-            roles = set(self.roles)
+            roles = set(map(utils.snowflake, self.roles))
             self.roles = [role for role in self.server.roles if role.id in roles]
 
+    def _transfer_stub(self, server):
+        """Returns a copy of the emoji which belongs to a stub of its server.
+        See :meth:`Server._transfer_stub`."""
+        ret = copy.copy(self)
+        ret.server = server
+        ret.roles = [role._transfer_stub(server) for role in self.roles]
+        return ret
+
     def _iterator(self):
         for attr in self.__slots__:
             value = getattr(self, attr, None)
@@ -151,8 +151,10 @@ class RoleConverter(IDConverter):
             raise NoPrivateMessage()
 
         match = self._get_id_match() or re.match(r'<@&([0-9]+)>$', self.argument)
-        params = dict(id=match.group(1)) if match else dict(name=self.argument)
-        result = discord.utils.get(server.roles, **params)
+        if match:
+            result = server.get_role(match.group(1))
+        else:
+            result = discord.utils.get(server.roles, name=self.argument)
         if result is None:
             raise BadArgument('Role "{}" not found.'.format(self.argument))
         return result
@@ -185,7 +187,7 @@ class EmojiConverter(IDConverter):
             if result is None:
                 result = discord.utils.get(bot.get_all_emojis(), name=self.argument)
         else:
-            emoji_id = match.group(1)
+            emoji_id = discord.utils.snowflake(match.group(1))
 
             # Try to look up emoji by id.
             if server:
@@ -33,10 +33,10 @@ from . import utils, compat
 from .enums import Status, try_enum
 from .game import Game
 from .errors import GatewayNotFound, ConnectionClosed, InvalidArgument
+from .waiters import WaiterRegistry
 import logging
-import zlib, time, json
-from collections import namedtuple
-import threading
+import zlib, time
+from collections import namedtuple, deque
 import struct
 
 log = logging.getLogger(__name__)
@@ -64,42 +64,68 @@ async def _ensure_coroutine_connect(gateway, *, loop, klass):
     ws = await websockets.connect(gateway, loop=loop, klass=klass)
     return ws
 
-class KeepAliveHandler(threading.Thread):
-    def __init__(self, *args, **kwargs):
-        ws = kwargs.pop('ws', None)
-        interval = kwargs.pop('interval', None)
-        threading.Thread.__init__(self, *args, **kwargs)
+class KeepAliveHandler:
+    """Sends heartbeats from a task on the websocket's event loop.
+
+    The time between sending each heartbeat and receiving its ACK is kept in
+    :attr:`latencies`. A slow ACK is only measured, but if several heartbeats in
+    a row go unacknowledged, the connection is assumed to be dead and is closed,
+    so that the client reconnects.
+    """
+    # the number of round trip times kept
+    HISTORY = 20
+    # the number of heartbeats in a row which may go unacknowledged before the connection is closed
+    MAX_MISSED_ACKS = 2
+    # whether missing ACKs close the connection
+    check_acks = True
+
+    def __init__(self, *, ws, interval):
         self.ws = ws
         self.interval = interval
-        self.daemon = True
         self.msg = 'Keeping websocket alive with sequence {0[d]}'
-        self._stop_ev = threading.Event()
-        self._last_ack = time.time()
-
-    def run(self):
-        while not self._stop_ev.wait(self.interval):
-            if self._last_ack + 2 * self.interval < time.time():
-                log.warn("We have stopped responding to the gateway.")
-                coro = self.ws.close(1001)
-                f = compat.run_coroutine_threadsafe(coro, loop=self.ws.loop)
-
-                try:
-                    f.result()
-                except:
-                    pass
-                finally:
-                    self.stop()
+        self.latencies = deque(maxlen=self.HISTORY)
+        self._last_ack = ws.loop.time()
+        # when the oldest unacknowledged heartbeat was sent, if there is one
+        self._last_send = None
+        # heartbeats sent in a row without an ACK
+        self._missed_acks = 0
+        self._task = None
+
+    @property
+    def latency(self):
+        """The round trip time of the last acknowledged heartbeat in seconds,
+        or ``None`` if none has been."""
+        return self.latencies[-1] if self.latencies else None
+
+    def start(self):
+        self._task = compat.create_task(self.run(), loop=self.ws.loop)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if self._last_send is not None:
+                    self._missed_acks += 1
+                    log.info("Heartbeat not acknowledged (%d in a row)", self._missed_acks)
+                if self.check_acks and self._missed_acks > self.MAX_MISSED_ACKS:
+                    log.warn("We have stopped responding to the gateway.")
+                    # closing stops us, so don't cancel ourselves partway through
+                    self._task = None
+                    await self.ws.close(1001)
                     return
 
-            data = self.get_payload()
-            log.debug(self.msg.format(data))
-            coro = self.ws.send_as_json(data)
-            f = compat.run_coroutine_threadsafe(coro, loop=self.ws.loop)
-            try:
-                # block until sending is complete
-                f.result()
-            except Exception:
-                self.stop()
+                await self.beat()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception('Stopped sending heartbeats')
+
+    async def beat(self):
+        data = self.get_payload()
+        log.debug(self.msg.format(data))
+        if self._last_send is None:
+            self._last_send = self.ws.loop.time()
+        await self.ws.send_as_json(data)
 
     def get_payload(self):
         return {
@@ -108,18 +134,26 @@ class KeepAliveHandler(threading.Thread):
         }
 
     def stop(self):
-        self._stop_ev.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
     def ack(self):
-        self._last_ack = time.time()
+        self._last_ack = self.ws.loop.time()
+        if self._last_send is not None:
+            self.latencies.append(self._last_ack - self._last_send)
+            self._last_send = None
+        self._missed_acks = 0
 
 class VoiceKeepAliveHandler(KeepAliveHandler):
+    # older voice servers do not always acknowledge heartbeats
+    check_acks = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.msg = 'Keeping voice websocket alive with timestamp {0[d]}'
 
     def get_payload(self):
-        self.ack()
         return {
             'op': self.ws.HEARTBEAT,
             'd': int(time.time() * 1000)
@@ -182,15 +216,21 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
     HEARTBEAT_ACK      = 11
     GUILD_SYNC         = 12
 
+    # the end of every payload in a zlib-stream connection
+    ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.max_size = None
         # an empty dispatcher to prevent crashes
         self._dispatch = lambda *args: None
         # generic event listeners
-        self._dispatch_listeners = []
+        self._dispatch_listeners = WaiterRegistry()
         # the keep alive
         self._keep_alive = None
+        # the inflate context for zlib-stream transport compression
+        self._zlib = None
+        self._buffer = bytearray()
 
     @classmethod
     async def from_client(cls, client, *, resume=False):
@@ -198,14 +238,24 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
 
         This is for internal use only.
         """
-        gateway = await client.http.get_gateway()
+        state = client.connection
+        if state.gateway is None:
+            state.gateway = await client.http.get_gateway()
+        gateway = state.gateway
+        if client.transport_compression:
+            gateway += '&compress=zlib-stream'
         try:
             ws = await asyncio.wait_for(
                     _ensure_coroutine_connect(gateway, loop=client.loop, klass=cls),
                     timeout=60)
         except asyncio.TimeoutError:
             log.warn('timed out waiting for client connect')
+            # the gateway may have moved, so fetch it again
+            state.gateway = None
             return (await cls.from_client(client, resume=resume))
+        except Exception:
+            state.gateway = None
+            raise
 
         # dynamically add attributes needed
         ws.token = client.http.token
@@ -214,6 +264,9 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
         ws.gateway = gateway
         ws.shard_id = client.shard_id
         ws.shard_count = client.shard_count
+        if client.transport_compression:
+            # every connection, including resumed ones, starts a new stream
+            ws._zlib = zlib.decompressobj()
 
         client.connection._update_references(ws)
 
@@ -265,9 +318,17 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
 
         future = asyncio.Future(loop=self.loop)
         entry = EventListener(event=event, predicate=predicate, result=result, future=future)
-        self._dispatch_listeners.append(entry)
+        self._dispatch_listeners.add(event, future, entry)
         return future
 
+    @property
+    def latency(self):
+        """Optional[float]: The round trip time of the last acknowledged heartbeat
+        in seconds, or ``None`` if none has been."""
+        if self._keep_alive is None:
+            return None
+        return self._keep_alive.latency
+
     async def identify(self):
         """Sends the IDENTIFY packet."""
         payload = {
@@ -281,7 +342,8 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
                     '$referrer': '',
                     '$referring_domain': ''
                 },
-                'compress': True,
+                # payloads are already compressed by the transport
+                'compress': self._zlib is None,
                 'large_threshold': 250,
                 'v': 3
             }
@@ -313,10 +375,18 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
         self._dispatch('socket_raw_receive', msg)
 
         if isinstance(msg, bytes):
-            msg = zlib.decompress(msg, 15, 10490000) # This is 10 MiB
-            msg = msg.decode('utf-8')
+            if self._zlib is None:
+                msg = zlib.decompress(msg, 15, 10490000) # This is 10 MiB
+            else:
+                # a payload may span several frames, and ends with a sync flush
+                self._buffer.extend(msg)
+                if len(msg) < 4 or msg[-4:] != self.ZLIB_SUFFIX:
+                    return
+                msg = self._zlib.decompress(self._buffer)
+                self._buffer.clear()
 
-        msg = json.loads(msg)
+        # the codec decodes UTF-8 bytes directly
+        msg = utils.from_json(msg)
         state = self._connection
 
         self._dispatch('socket_response', msg)
@@ -340,8 +410,7 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
             return
 
         if op == self.HEARTBEAT:
-            beat = self._keep_alive.get_payload()
-            await self.send_as_json(beat)
+            await self._keep_alive.beat()
             return
 
         if op == self.HELLO:
@@ -356,6 +425,9 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
                 await self.close()
                 raise ResumeWebSocket()
 
+            if state.restored:
+                # READY must not be applied on top of a session that Discord rejected
+                state.clear()
             state.sequence = None
             state.session_id = None
 
@@ -374,39 +446,22 @@ class DiscordWebSocket(websockets.WebSocketClientProtocol):
             state.sequence = msg['s']
             state.session_id = data['session_id']
 
-        parser = 'parse_' + event.lower()
-
-        try:
-            func = getattr(self._connection, parser)
-        except AttributeError:
+        func = state.parsers.get(event)
+        if func is None:
             log.info('Unhandled event {}'.format(event))
         else:
             func(data)
 
-        # remove the dispatched listeners
-        removed = []
-        for index, entry in enumerate(self._dispatch_listeners):
-            if entry.event != event:
-                continue
-
-            future = entry.future
-            if future.cancelled():
-                removed.append(index)
-                continue
-
+        # resolve the listeners waiting for this event
+        for future, entry in self._dispatch_listeners.waiting(event):
             try:
                 valid = entry.predicate(data)
             except Exception as e:
                 future.set_exception(e)
-                removed.append(index)
             else:
                 if valid:
                     ret = data if entry.result is None else entry.result(data)
                     future.set_result(ret)
-                    removed.append(index)
-
-        for index in reversed(removed):
-            del self._dispatch_listeners[index]
 
     def _can_handle_close(self, code):
         return code not in (1000, 4004, 4010, 4011)
@@ -529,6 +584,8 @@ class DiscordVoiceWebSocket(websockets.WebSocketClientProtocol):
         Receive only. Gives you the secret key required for voice.
     SPEAKING
         Send only. Notifies the client if you are currently speaking.
+    HEARTBEAT_ACK
+        Receive only. Confirms receiving of a heartbeat.
     """
 
     IDENTIFY            = 0
@@ -537,6 +594,7 @@ class DiscordVoiceWebSocket(websockets.WebSocketClientProtocol):
     HEARTBEAT           = 3
     SESSION_DESCRIPTION = 4
     SPEAKING            = 5
+    HEARTBEAT_ACK       = 6
     HELLO               = 8
 
     def __init__(self, *args, **kwargs):
@@ -625,6 +683,8 @@ class DiscordVoiceWebSocket(websockets.WebSocketClientProtocol):
             await self.initial_connection(data)
         elif op == self.SESSION_DESCRIPTION:
             await self.load_secret_key(data)
+        elif op == self.HEARTBEAT_ACK and self._keep_alive:
+            self._keep_alive.ack()
 
     async def initial_connection(self, data):
         state = self._connection
@@ -657,7 +717,7 @@ class DiscordVoiceWebSocket(websockets.WebSocketClientProtocol):
     async def poll_event(self):
         try:
             msg = await asyncio.wait_for(self.recv(), timeout=30.0)
-            await self.received_message(json.loads(msg))
+            await self.received_message(utils.from_json(msg))
         except websockets.exceptions.ConnectionClosed as e:
             raise ConnectionClosed(e) from e
 
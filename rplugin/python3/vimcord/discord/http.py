@@ -26,7 +26,6 @@ DEALINGS IN THE SOFTWARE.
 
 import aiohttp
 import asyncio
-import json
 import sys
 import logging
 import weakref
@@ -39,10 +38,10 @@ from .errors import HTTPException, Forbidden, NotFound, LoginFailure, GatewayNot
 from . import __version__, utils
 
 async def json_or_text(response):
-    text = await response.text(encoding='utf-8')
+    body = await response.read()
     if response.headers['content-type'] == 'application/json':
-        return json.loads(text)
-    return text
+        return utils.from_json(body)
+    return body.decode('utf-8')
 
 class Route:
     BASE = 'https://discordapp.com/api/v6'
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+
+"""Compares the installed JSON backends on gateway payloads.
+
+Run with the paths of recorded payloads, such as READY and GUILD_CREATE
+dispatches saved from an ``on_socket_response`` handler with
+:func:`utils.to_json`::
+
+    python -m vimcord.discord.json_benchmark READY.json GUILD_CREATE.json
+
+Without any paths, a synthetic GUILD_CREATE for a large server is used.
+"""
+
+import sys
+import timeit
+
+from . import utils
+
+def _synthetic_guild_create(members=20000, channels=200):
+    snowflake = iter(range(80351110224678912, 1 << 62, 4194304))
+    roles = [{'id': str(next(snowflake)), 'name': 'role {}'.format(i), 'color': i,
+              'position': i, 'permissions': 104324161, 'hoist': False,
+              'managed': False, 'mentionable': True} for i in range(50)]
+    return {
+        'op': 0, 's': 2, 't': 'GUILD_CREATE',
+        'd': {
+            'id': str(next(snowflake)), 'name': 'benchmark', 'large': True,
+            'member_count': members, 'roles': roles,
+            'channels': [{
+                'id': str(next(snowflake)), 'type': 0, 'position': i,
+                'name': 'channel-{}'.format(i), 'topic': 'topic é中 {}'.format(i),
+                'permission_overwrites': [{'id': roles[i % 50]['id'], 'type': 'role',
+                                           'allow': 1024, 'deny': 2048}],
+                'last_message_id': str(next(snowflake)),
+            } for i in range(channels)],
+            'members': [{
+                'user': {'id': str(next(snowflake)), 'username': 'user {}'.format(i),
+                         'discriminator': '{:04}'.format(i % 10000), 'avatar': None},
+                'roles': [roles[i % 50]['id'], roles[(i * 7) % 50]['id']],
+                'nick': None, 'deaf': False, 'mute': False,
+                'joined_at': '2017-01-01T00:00:00.000000+00:00',
+            } for i in range(members)],
+            'presences': [{
+                'user': {'id': str(next(snowflake))}, 'status': 'online',
+                'game': {'name': 'game {}'.format(i), 'type': 0},
+            } for i in range(members // 4)],
+        },
+    }
+
+def _time(function, argument, number):
+    return min(timeit.repeat(lambda: function(argument), number=number, repeat=3)) / number
+
+def benchmark(payloads, number=5):
+    """Prints the time each backend takes to decode and encode each payload.
+
+    ``payloads`` maps names to payloads as UTF-8 encoded JSON.
+    """
+    print('selected backend: {}'.format(utils.JSON_BACKEND))
+    for name, raw in payloads.items():
+        print('{} ({:.1f} MiB)'.format(name, len(raw) / (1 << 20)))
+        obj = utils.from_json(raw)
+        for backend, (dumps, loads) in utils.JSON_CODECS.items():
+            decode = _time(loads, raw, number)
+            encode = _time(dumps, obj, number)
+            print('  {:<8} decode {:8.2f} ms  encode {:8.2f} ms'.format(
+                backend, decode * 1000, encode * 1000))
+
+def main(paths):
+    if paths:
+        payloads = {}
+        for path in paths:
+            with open(path, 'rb') as f:
+                payloads[path] = f.read()
+    else:
+        payload = _synthetic_guild_create()
+        payloads = {'synthetic GUILD_CREATE': utils.to_json(payload).encode('utf-8')}
+    benchmark(payloads)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
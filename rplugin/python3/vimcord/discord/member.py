@@ -87,8 +87,9 @@ class Member(User):
         The member's voice state. Properties are defined to mirror access of the attributes.
         e.g. ``Member.is_afk`` is equivalent to `Member.voice.is_afk``.
     roles
-        A list of :class:`Role` that the member belongs to. Note that the first element of this
-        list is always the default '@everyone' role.
+        A sequence of :class:`Role` that the member belongs to. Note that the first element of this
+        sequence is always the default '@everyone' role. Members of a server with the same roles
+        may share the same tuple, so it should be replaced rather than modified.
     joined_at : `datetime.datetime`
         A datetime object that specifies the date and time in UTC that the member joined the server for
         the first time.
@@ -146,6 +147,16 @@ class Member(User):
         ret.voice = copy.copy(self.voice)
         return ret
 
+    def _transfer_stub(self, server):
+        """Returns a copy of the member which belongs to a stub of its server.
+        Its roles are kept so that :attr:`colour` still works, but the voice
+        channel is dropped. See :meth:`Server._transfer_stub`."""
+        ret = self._copy()
+        ret.server = server
+        ret.voice.voice_channel = None
+        ret.roles = [role._transfer_stub(server) for role in self.roles]
+        return ret
+
     @property
     def colour(self):
         """A property that returns a :class:`Colour` denoting the rendered colour
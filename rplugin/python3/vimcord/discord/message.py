@@ -32,6 +32,32 @@ from .calls import CallMessage
 import re
 from .enums import MessageType, try_enum
 
+def _transfer_stub(obj, server):
+    """Returns a stub of a model object, if it has one. Users and strings are returned as-is."""
+    transfer_stub = getattr(obj, '_transfer_stub', None)
+    return obj if transfer_stub is None else transfer_stub(server)
+
+def _rebuild_message(attrs, data, reactions, call):
+    """Reconstructs a :class:`Message` pickled with :meth:`Message.__reduce__`."""
+    message = Message.__new__(Message)
+    for name, value in zip(Message._transfer_slots, attrs):
+        setattr(message, name, value)
+    message._users = None
+    # the rest is built from the data when it is first accessed, as usual
+    message._data = data
+    message.reactions = [
+        Reaction(message=message, emoji=emoji, count=count, me=me)
+        for emoji, count, me in reactions
+    ]
+
+    if call is not None:
+        message._call = CallMessage(message=message)
+        message._call.ended_timestamp, participant_ids = call
+        message._call.participants = [
+            user for user in (message.author, *message.mentions) if user.id in participant_ids
+        ]
+    return message
+
 class Message:
     """Represents a message from Discord.
 
@@ -107,14 +133,21 @@ class Message:
         Reactions to a message. Reactions can be either custom emoji or standard unicode emoji.
     """
 
-    __slots__ = [ 'edited_timestamp', 'timestamp', 'tts', 'content', 'channel',
-                  'mention_everyone', 'embeds', 'id', 'mentions', 'author',
-                  'channel_mentions', 'server', '_raw_mentions', 'attachments',
+    __slots__ = [ '_edited_timestamp', '_timestamp', 'tts', 'content', 'channel',
+                  'mention_everyone', 'embeds', 'id', '_mentions', '_author',
+                  '_channel_mentions', 'server', '_raw_mentions', 'attachments',
                   '_clean_content', '_raw_channel_mentions', 'nonce', 'pinned',
-                  'role_mentions', '_raw_role_mentions', 'type', 'call',
-                  '_system_content', 'reactions', 'referenced_message' ]
+                  '_role_mentions', '_raw_role_mentions', 'type', '_call',
+                  '_system_content', 'reactions', '_referenced_message', '_data',
+                  '_users' ]
+
+    # attributes which are pickled as a flat tuple; see __reduce__
+    _transfer_slots = ( 'id', 'type', 'content', 'tts', 'pinned', 'mention_everyone',
+                        'nonce', 'embeds', 'attachments', 'server', 'channel' )
 
     def __init__(self, **kwargs):
+        # the UserCache which authors and mentions are shared through, if any
+        self._users = kwargs.pop('users', None)
         if "reactions" in kwargs:
             self.reactions = kwargs.pop('reactions')
         else:
@@ -123,13 +156,77 @@ class Message:
             reaction.message = self
         self._update(**kwargs)
 
+    def __copy__(self):
+        ret = Message.__new__(Message)
+        for attr in self.__slots__:
+            try:
+                setattr(ret, attr, getattr(self, attr))
+            except AttributeError:
+                pass
+        return ret
+
+    def __reduce__(self):
+        # Pickling the message as-is would also pickle its server, along with every
+        # member, role, emoji and channel in it. Instead, the server is replaced
+        # with a stub that every other object in the message shares, holding only
+        # what the message's data refers to. The raw data is sent rather than the
+        # attributes built from it, which are built on the other side if needed.
+        server = None
+        if self.server is not None:
+            server = self.server._transfer_stub()
+            self._add_references(server)
+        attrs = [getattr(self, name) for name in self._transfer_slots]
+        attrs[self._transfer_slots.index('server')] = server
+        attrs[self._transfer_slots.index('channel')] = _transfer_stub(self.channel, server)
+
+        # the channel is sent separately above
+        data = {key: value for key, value in self._data.items() if key != 'channel'}
+        reactions = [
+            (_transfer_stub(reaction.emoji, server), reaction.count, reaction.me)
+            for reaction in self.reactions
+        ]
+        # calls updated after the message was created differ from its data
+        call = getattr(self, '_call', None)
+        if call is not None:
+            call = (call.ended_timestamp, [user.id for user in call.participants])
+        return _rebuild_message, (attrs, data, reactions, call)
+
+    def _add_references(self, stub):
+        """Adds the members, channels and roles which the message's data refers to
+        to a stub of its server, so that its attributes can be built from the stub."""
+        data = self._data
+        user_ids = [data.get('author', {}).get('id')]
+        user_ids.extend(mention.get('id') for mention in data.get('mentions', []))
+        referenced_message = data.get('referenced_message')
+        if referenced_message is not None:
+            user_ids.append(referenced_message.get('author', {}).get('id'))
+            user_ids.extend(mention.get('id') for mention in referenced_message.get('mentions', []))
+        for user_id in user_ids:
+            member = self.server.get_member(user_id)
+            if member is not None and stub.get_member(user_id) is None:
+                stub._add_member(member._transfer_stub(stub))
+
+        if '<#' in self.content:
+            for channel_id in self.raw_channel_mentions:
+                channel = self.server.get_channel(channel_id)
+                if channel is not None:
+                    stub._add_channel(_transfer_stub(channel, stub))
+
+        roles = (self.server.get_role(role_id) for role_id in data.get('mention_roles', []))
+        stub.roles = [role._transfer_stub(stub) for role in roles if role is not None]
+        stub._reindex_roles()
+
     def _update(self, **data):
-        # at the moment, the timestamps seem to be naive so they have no time zone and operate on UTC time.
-        # we can use this to our advantage to use strptime instead of a complicated parsing routine.
-        # example timestamp: 2015-08-21T12:03:45.782000+00:00
-        # sometimes the .%f modifier is missing
-        self.edited_timestamp = utils.parse_time(data.get('edited_timestamp'))
-        self.timestamp = utils.parse_time(data.get('timestamp'))
+        # clear the cached properties, along with any attributes built from the old data
+        cached = filter(lambda attr: attr[0] == '_' and attr != '_users', self.__slots__)
+        for attr in cached:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                pass
+
+        # the rest of the attributes are built when they are first accessed
+        self._data = data
         self.tts = data.get('tts', False)
         self.pinned = data.get('pinned', False)
         self.content = data.get('content', '')
@@ -139,62 +236,100 @@ class Message:
             log.error("Retrieved data without content: %s", data)
         self.mention_everyone = data.get('mention_everyone')
         self.embeds = data.get('embeds', [])
-        self.id = data.get('id')
+        self.id = utils.snowflake(data.get('id'))
         self.channel = data.get('channel')
-        self.author = User(**data.get('author', {}))
         self.nonce = data.get('nonce')
         self.attachments = data.get('attachments', [])
         self.type = try_enum(MessageType, data.get('type'))
-        if (referenced_message := data.get("referenced_message")) is not None:
-            referenced_message.update({"channel": self.channel})
-            self.referenced_message = Message(**referenced_message)
-        else:
-            self.referenced_message = None
         self._handle_upgrades(data.get('channel_id'))
-        self._handle_mentions(data.get('mentions', []), data.get('mention_roles', []))
-        self._handle_call(data.get('call'))
-
-        # clear the cached properties
-        cached = filter(lambda attr: attr[0] == '_', self.__slots__)
-        for attr in cached:
-            try:
-                delattr(self, attr)
-            except AttributeError:
-                pass
-
-    def _handle_mentions(self, mentions, role_mentions):
-        self.mentions = []
-        self.channel_mentions = []
-        self.role_mentions = []
-        if getattr(self.channel, 'is_private', True):
-            self.mentions = [User(**m) for m in mentions]
-            return
 
+    @utils.cached_slot_property('_timestamp')
+    def timestamp(self):
+        # a message's ID is generated when it is created, so the time can be read from it
+        # instead of parsing the timestamp.
+        try:
+            return utils.snowflake_time(self.id)
+        except (TypeError, ValueError):
+            return utils.parse_time(self._data.get('timestamp'))
+
+    @utils.cached_slot_property('_edited_timestamp')
+    def edited_timestamp(self):
+        # at the moment, the timestamps seem to be naive so they have no time zone and operate on UTC time.
+        # example timestamp: 2015-08-21T12:03:45.782000+00:00
+        return utils.parse_time(self._data.get('edited_timestamp'))
+
+    def _get_user(self, data):
+        if self._data.get('webhook_id') is not None:
+            # webhooks send each message with its own name and avatar
+            return User(**data)
+        if self._users is not None:
+            # the data may be from long before this is built, so it is not
+            # applied to the shared user; the state updates it on arrival
+            return self._users.get(data, update=False)
+        # unpickled, so share the users which a private channel already has
+        user_id = utils.snowflake(data.get('id'))
+        for user in (*getattr(self.channel, 'recipients', ()), getattr(self.channel, 'me', None)):
+            if user is not None and user.id == user_id:
+                return user
+        return User(**data)
+
+    @utils.cached_slot_property('_author')
+    def author(self):
+        data = self._data.get('author', {})
         if self.server is not None:
-            for mention in mentions:
-                id_search = mention.get('id')
-                member = self.server.get_member(id_search)
-                if member is not None:
-                    self.mentions.append(member)
-
-            it = filter(None, map(lambda m: self.server.get_channel(m), self.raw_channel_mentions))
-            self.channel_mentions = utils._unique(it)
-
-            for role_id in role_mentions:
-                role = utils.get(self.server.roles, id=role_id)
-                if role is not None:
-                    self.role_mentions.append(role)
+            member = self.server.get_member(data.get('id'))
+            if member is not None:
+                return member
+        return self._get_user(data)
+
+    @utils.cached_slot_property('_referenced_message')
+    def referenced_message(self):
+        referenced_message = self._data.get('referenced_message')
+        if referenced_message is None:
+            return None
+        return Message(channel=self.channel, users=self._users, **referenced_message)
+
+    @utils.cached_slot_property('_mentions')
+    def mentions(self):
+        mentions = self._data.get('mentions', [])
+        if getattr(self.channel, 'is_private', True):
+            return [self._get_user(m) for m in mentions]
+        if self.server is None:
+            return []
+
+        members = (self.server.get_member(mention.get('id')) for mention in mentions)
+        return [member for member in members if member is not None]
+
+    @utils.cached_slot_property('_channel_mentions')
+    def channel_mentions(self):
+        if getattr(self.channel, 'is_private', True) or self.server is None:
+            return []
+        it = filter(None, map(lambda m: self.server.get_channel(m), self.raw_channel_mentions))
+        return utils._unique(it)
+
+    @utils.cached_slot_property('_role_mentions')
+    def role_mentions(self):
+        if getattr(self.channel, 'is_private', True) or self.server is None:
+            return []
+        roles = (self.server.get_role(role_id) for role_id in self._data.get('mention_roles', []))
+        return [role for role in roles if role is not None]
+
+    @utils.cached_slot_property('_call')
+    def call(self):
+        return self._make_call(self._data.get('call'))
 
     def _handle_call(self, call):
+        self.call = self._make_call(call)
+
+    def _make_call(self, call):
         if call is None or self.type is not MessageType.call:
-            self.call = None
-            return
+            return None
 
         # we get the participant source from the mentions array or
         # the author
 
         participants = []
-        for uid in call.get('participants', []):
+        for uid in map(utils.snowflake, call.get('participants', [])):
             if uid == self.author.id:
                 participants.append(self.author)
             else:
@@ -202,8 +337,7 @@ class Message:
                 if user is not None:
                     participants.append(user)
 
-        call['participants'] = participants
-        self.call = CallMessage(message=self, **call)
+        return CallMessage(message=self, **dict(call, participants=participants))
 
     @utils.cached_slot_property('_raw_mentions')
     def raw_mentions(self):
@@ -290,15 +424,12 @@ class Message:
 
         if self.channel is None:
             if channel_id is not None:
-                self.channel = Object(id=channel_id)
+                self.channel = Object(id=utils.snowflake(channel_id))
                 self.channel.is_private = True
             return
 
         if not self.channel.is_private:
             self.server = self.channel.server
-            found = self.server.get_member(self.author.id)
-            if found is not None:
-                self.author = found
 
     @utils.cached_slot_property('_system_content')
     def system_content(self):
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from collections import OrderedDict
+
+class MessageCache:
+    """An ordered store of :class:`Message` keyed by their ID, with a bounded
+    buffer for each channel.
+
+    Iterating over the cache gives messages from oldest to newest, like the
+    deque it replaces. Looking up or removing a message by ID takes constant
+    time, as does iterating over a single channel with :meth:`in_channel`.
+
+    Once a channel has more than ``per_channel`` messages, its oldest are
+    evicted. Once there are more than ``maxlen`` messages in total, messages are
+    evicted from the least recently active channel which has more than
+    ``channel_reserve`` messages, so that a busy channel cannot push every
+    other channel's history out of the cache.
+
+    Attributes
+    -----------
+    maxlen : int
+        The maximum number of messages stored.
+    per_channel : int
+        The maximum number of messages stored for any one channel.
+    channel_reserve : int
+        The number of messages in each channel kept when evicting for other channels.
+    """
+
+    def __init__(self, maxlen, per_channel=None, channel_reserve=0):
+        self.maxlen = maxlen
+        self.per_channel = per_channel or maxlen
+        self.channel_reserve = min(channel_reserve, self.per_channel)
+        # every message, oldest first
+        self._messages = OrderedDict()
+        # channel ID -> that channel's messages, least recently active channel first
+        self._channels = OrderedDict()
+        # channel IDs with more than channel_reserve messages, least recently active first
+        self._over_reserve = OrderedDict()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages.values())
+
+    def __reversed__(self):
+        return reversed(self._messages.values())
+
+    def __contains__(self, message):
+        return self._messages.get(message.id) is message
+
+    @staticmethod
+    def _channel_id(message):
+        return getattr(message.channel, 'id', None)
+
+    def get(self, message_id):
+        """Returns the message with the given ID, or None if it is not cached."""
+        return self._messages.get(message_id)
+
+    def in_channel(self, channel_id):
+        """Returns an iterator over the cached messages in a channel, oldest first."""
+        return iter(self._channels.get(channel_id, {}).values())
+
+    def append(self, message):
+        """Adds a message as the newest in the cache, replacing any with the same ID."""
+        self.pop(message.id)
+        self._messages[message.id] = message
+
+        channel_id = self._channel_id(message)
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = OrderedDict()
+        else:
+            self._channels.move_to_end(channel_id)
+        channel[message.id] = message
+
+        if len(channel) > self.channel_reserve:
+            self._over_reserve[channel_id] = None
+            self._over_reserve.move_to_end(channel_id)
+        if len(channel) > self.per_channel:
+            self._evict_from(channel_id)
+        while len(self._messages) > self.maxlen:
+            self._evict()
+
+    def _evict(self):
+        if self._over_reserve:
+            channel_id = next(iter(self._over_reserve))
+        else:
+            channel_id = next(iter(self._channels))
+        self._evict_from(channel_id)
+
+    def _evict_from(self, channel_id):
+        channel = self._channels[channel_id]
+        message_id, _ = channel.popitem(last=False)
+        del self._messages[message_id]
+        self._shrunk(channel_id, channel)
+
+    def _shrunk(self, channel_id, channel):
+        if not channel:
+            del self._channels[channel_id]
+        if len(channel) <= self.channel_reserve:
+            self._over_reserve.pop(channel_id, None)
+
+    def remove(self, message):
+        """Removes a message from the cache. Raises ValueError if it is not cached."""
+        if self.pop(message.id) is None:
+            raise ValueError('message not in cache')
+
+    def pop(self, message_id):
+        """Removes and returns the message with the given ID, or None if it is not cached."""
+        message = self._messages.pop(message_id, None)
+        if message is not None:
+            channel_id = self._channel_id(message)
+            channel = self._channels[channel_id]
+            del channel[message_id]
+            self._shrunk(channel_id, channel)
+        return message
+
+    def pop_many(self, message_ids):
+        """Removes the messages with the given IDs. Returns the ones which were cached."""
+        popped = (self.pop(message_id) for message_id in message_ids)
+        return [message for message in popped if message is not None]
+
+    def remove_channels(self, channel_ids):
+        """Removes every message in the given channels."""
+        for channel_id in channel_ids:
+            channel = self._channels.pop(channel_id, None)
+            self._over_reserve.pop(channel_id, None)
+            for message_id in channel or ():
+                del self._messages[message_id]
+
+    def clear(self):
+        self._messages.clear()
+        self._channels.clear()
+        self._over_reserve.clear()
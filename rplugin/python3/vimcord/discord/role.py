@@ -27,7 +27,9 @@ DEALINGS IN THE SOFTWARE.
 from .permissions import Permissions
 from .colour import Colour
 from .mixins import Hashable
+from . import utils
 from .utils import snowflake_time
+import copy
 
 class Role(Hashable):
     """Represents a Discord role in a :class:`Server`.
@@ -119,7 +121,7 @@ class Role(Hashable):
         return not r
 
     def _update(self, **kwargs):
-        self.id = kwargs.get('id')
+        self.id = utils.snowflake(kwargs.get('id'))
         self.name = kwargs.get('name')
         self.permissions = Permissions(kwargs.get('permissions', 0))
         self.position = kwargs.get('position', 0)
@@ -129,6 +131,13 @@ class Role(Hashable):
         self.mentionable = kwargs.get('mentionable', False)
         self.color = self.colour
 
+    def _transfer_stub(self, server):
+        """Returns a copy of the role which belongs to a stub of its server.
+        See :meth:`Server._transfer_stub`."""
+        ret = copy.copy(self)
+        ret.server = server
+        return ret
+
     @property
     def is_everyone(self):
         """Checks if the role is the @everyone role."""
@@ -112,7 +112,7 @@ class Server(Hashable):
                  'name', 'id', 'owner', 'unavailable', 'name', 'region',
                  '_default_role', '_default_channel', 'roles', '_member_count',
                  'large', 'owner_id', 'mfa_level', 'emojis', 'features',
-                 'verification_level', 'splash' ]
+                 'verification_level', 'splash', '_role_index', '_interned_roles' ]
 
     def __init__(self, **kwargs):
         self._channels = {}
@@ -120,13 +120,36 @@ class Server(Hashable):
         self._members = {}
         self._from_data(kwargs)
 
+    def get_role(self, role_id):
+        """Returns a :class:`Role` with the given ID. If not found, returns None."""
+        return self._role_index.get(utils.snowflake(role_id))
+
+    def _reindex_roles(self):
+        self._role_index = {role.id: role for role in self.roles}
+        # sort order may have changed
+        self._interned_roles = {}
+
+    def _member_roles(self, role_ids):
+        """Returns a sorted tuple of the @everyone role and the roles with the given IDs.
+
+        Members with the same roles share the same tuple.
+        """
+        key = tuple(role_ids)
+        roles = self._interned_roles.get(key)
+        if roles is None:
+            found = (self._role_index.get(utils.snowflake(role_id)) for role_id in key)
+            roles = [self.default_role]
+            roles.extend(role for role in found if role is not None)
+            roles = self._interned_roles[key] = tuple(sorted(roles))
+        return roles
+
     @property
     def channels(self):
         return self._channels.values()
 
     def get_channel(self, channel_id):
         """Returns a :class:`Channel` with the given ID. If not found, returns None."""
-        return self._channels.get(channel_id)
+        return self._channels.get(utils.snowflake(channel_id))
 
     def _add_channel(self, channel):
         self._channels[channel.id] = channel
@@ -140,7 +163,7 @@ class Server(Hashable):
 
     def get_member(self, user_id):
         """Returns a :class:`Member` with the given ID. If not found, returns None."""
-        return self._members.get(user_id)
+        return self._members.get(utils.snowflake(user_id))
 
     def _add_member(self, member):
         self._members[member.id] = member
@@ -151,12 +174,37 @@ class Server(Hashable):
     def __str__(self):
         return self.name
 
-    def _update_voice_state(self, data):
+    def _transfer_stub(self):
+        """Returns a copy of the server with none of its members, channels, roles or emojis.
+
+        Objects which refer to a server (e.g., a :class:`Message`) use this to
+        avoid pickling the server's entire object graph along with them.
+        """
+        ret = Server.__new__(Server)
+        for attr in ('id', 'name', 'icon', 'region', 'unavailable', 'large', 'owner_id',
+                     'afk_timeout', 'mfa_level', 'verification_level', 'features', 'splash',
+                     '_member_count'):
+            try:
+                setattr(ret, attr, getattr(self, attr))
+            except AttributeError:
+                pass
+        ret._members = {}
+        ret._channels = {}
+        ret.roles = []
+        ret._role_index = {}
+        ret._interned_roles = {}
+        ret.emojis = []
+        ret.owner = None
+        ret.afk_channel = None
+        return ret
+
+    def _update_voice_state(self, data, snapshot=True):
         user_id = data.get('user_id')
         member = self.get_member(user_id)
         before = None
         if member is not None:
-            before = member._copy()
+            if snapshot:
+                before = member._copy()
             ch_id = data.get('channel_id')
             channel = self.get_channel(ch_id)
             member._update_voice_state(voice_channel=channel, **data)
@@ -172,10 +220,12 @@ class Server(Hashable):
             r.position += bool(r.position)
 
         self.roles.append(role)
+        self._reindex_roles()
 
     def _remove_role(self, role):
         # this raises ValueError if it fails..
         self.roles.remove(role)
+        self._reindex_roles()
 
         # since it didn't, we can change the positions now
         # basically the same as above except we only decrement
@@ -196,21 +246,16 @@ class Server(Hashable):
         self.afk_timeout = guild.get('afk_timeout')
         self.icon = guild.get('icon')
         self.unavailable = guild.get('unavailable', False)
-        self.id = guild['id']
+        self.id = utils.snowflake(guild['id'])
         self.roles = [Role(server=self, **r) for r in guild.get('roles', [])]
+        self._reindex_roles()
         self.mfa_level = guild.get('mfa_level')
         self.emojis = [Emoji(server=self, **r) for r in guild.get('emojis', [])]
         self.features = guild.get('features', [])
         self.splash = guild.get('splash')
 
         for mdata in guild.get('members', []):
-            roles = [self.default_role]
-            for role_id in mdata['roles']:
-                role = utils.find(lambda r: r.id == role_id, self.roles)
-                if role is not None:
-                    roles.append(role)
-
-            mdata['roles'] = sorted(roles)
+            mdata['roles'] = self._member_roles(mdata['roles'])
             member = Member(**mdata)
             member.server = self
             self._add_member(member)
@@ -219,14 +264,14 @@ class Server(Hashable):
         self.large = None if member_count is None else self._member_count >= 250
 
         if 'owner_id' in guild:
-            self.owner_id = guild['owner_id']
+            self.owner_id = utils.snowflake(guild['owner_id'])
             self.owner = self.get_member(self.owner_id)
 
         afk_id = guild.get('afk_channel_id')
         self.afk_channel = self.get_channel(afk_id)
 
         for obj in guild.get('voice_states', []):
-            self._update_voice_state(obj)
+            self._update_voice_state(obj, snapshot=False)
 
     def _sync(self, data):
         if 'large' in data:
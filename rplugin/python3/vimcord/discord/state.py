@@ -25,7 +25,7 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from .server import Server
-from .user import User
+from .user import User, UserCache
 from .game import Game
 from .emoji import Emoji
 from .reaction import Reaction
@@ -36,8 +36,10 @@ from .role import Role
 from . import utils, compat
 from .enums import Status, ChannelType, try_enum
 from .calls import GroupCall
+from .message_cache import MessageCache
+from .waiters import WaiterRegistry
 
-from collections import deque, namedtuple
+from collections import namedtuple, Counter
 import copy, enum, math
 import datetime
 import asyncio
@@ -50,55 +52,91 @@ Listener = namedtuple('Listener', ('type', 'future', 'predicate'))
 log = logging.getLogger(__name__)
 ReadyState = namedtuple('ReadyState', ('launch', 'servers'))
 
+# members added from a GUILD_MEMBERS_CHUNK before yielding to the event loop
+MEMBER_CHUNK_SLICE = 250
+
 class ConnectionState:
-    def __init__(self, dispatch, chunker, syncer, max_messages, *, loop):
+    def __init__(self, dispatch, chunker, syncer, max_messages, *, loop,
+                 max_channel_messages=None, channel_message_reserve=0, int_ids=False,
+                 wants_snapshot=None, coalesce_windows=None):
         self.loop = loop
+        # event name -> seconds to merge repeated updates to the same object for
+        self.coalesce_windows = dict(coalesce_windows or {})
+        # number of events merged into another, by event name
+        self.coalesced = Counter()
+        # (event, key) -> [timer, args of the first event, args of the latest event]
+        self._coalescing = {}
+        # called with an event name to check whether its handlers use the state before an update
+        self.wants_snapshot = wants_snapshot or (lambda event: True)
+        # event name -> function returning what the event's handlers need from an object
+        # before an update, in place of a full copy of it
+        self.snapshot_factories = {}
+        # whether snowflake IDs are stored as integers, see utils.use_int_ids
+        self.int_ids = int_ids
+        utils.use_int_ids(int_ids)
         self.max_messages = max_messages
+        self.max_channel_messages = max_channel_messages
+        self.channel_message_reserve = channel_message_reserve
         self.dispatch = dispatch
         self.chunker = chunker
         self.syncer = syncer
         self.is_bot = None
-        self._listeners = []
+        # the gateway URL, kept across reconnects
+        self.gateway = None
+        self._listeners = WaiterRegistry()
         self.clear()
+        self.build_parsers()
 
     def clear(self):
+        self.flush_coalesced()
         self.user = None
+        # whether the state was restored from disk and has not been resumed yet
+        self.restored = False
+        self._users = UserCache()
         self.sequence = None
         self.session_id = None
         self._calls = {}
+        # task adding the members from large GUILD_MEMBERS_CHUNKs. Members from
+        # the old session must not be added to the new one's servers
+        ingestion = getattr(self, '_member_ingestion', None)
+        if ingestion is not None and not ingestion.done():
+            ingestion.cancel()
+        self._member_ingestion = None
         self._servers = {}
+        # indexes of every server's channels and emojis by id
+        self._channels = {}
+        self._emojis = {}
         self._voice_clients = {}
         self._private_channels = {}
         # extra dict to look up private channels by user id
         self._private_channels_by_user = {}
-        self.messages = deque(maxlen=self.max_messages)
-
-    def process_listeners(self, listener_type, argument, result):
-        removed = []
-        for i, listener in enumerate(self._listeners):
-            if listener.type != listener_type:
-                continue
-
-            future = listener.future
-            if future.cancelled():
-                removed.append(i)
-                continue
-
+        self.messages = MessageCache(self.max_messages, self.max_channel_messages,
+                                     self.channel_message_reserve)
+
+    def build_parsers(self):
+        """Builds the table of gateway event names to their ``parse_`` methods.
+
+        This must be called again after a parser is replaced on the instance.
+        """
+        self.parsers = {
+            name[len('parse_'):].upper(): getattr(self, name)
+            for name in dir(self) if name.startswith('parse_')
+        }
+
+    def process_listeners(self, listener_type, argument, result, key=None):
+        # listeners are registered under their type and a key, such as the
+        # guild ID for chunks, so only the relevant ones are checked here
+        for future, listener in self._listeners.waiting((listener_type, key)):
             try:
                 passed = listener.predicate(argument)
             except Exception as e:
                 future.set_exception(e)
-                removed.append(i)
             else:
                 if passed:
                     future.set_result(result)
-                    removed.append(i)
                     if listener.type == ListenerType.chunk:
                         break
 
-        for index in reversed(removed):
-            del self._listeners[index]
-
     @property
     def voice_clients(self):
         return self._voice_clients.values()
@@ -121,23 +159,46 @@ class ConnectionState:
         return self._servers.values()
 
     def _get_server(self, server_id):
-        return self._servers.get(server_id)
+        return self._servers.get(utils.snowflake(server_id))
 
     def _add_server(self, server):
+        old_server = self._servers.get(server.id)
+        if old_server is not None:
+            self._unindex_server(old_server)
         self._servers[server.id] = server
+        self._index_server(server)
 
     def _remove_server(self, server):
         self._servers.pop(server.id, None)
+        self._unindex_server(server)
+
+    def _index_server(self, server):
+        for channel in server.channels:
+            self._channels[channel.id] = channel
+        self._index_emojis(server.emojis)
+
+    def _unindex_server(self, server):
+        for channel in server.channels:
+            self._channels.pop(channel.id, None)
+        self._unindex_emojis(server.emojis)
+
+    def _index_emojis(self, emojis):
+        for emoji in emojis:
+            self._emojis[emoji.id] = emoji
+
+    def _unindex_emojis(self, emojis):
+        for emoji in emojis:
+            self._emojis.pop(emoji.id, None)
 
     @property
     def private_channels(self):
         return self._private_channels.values()
 
     def _get_private_channel(self, channel_id):
-        return self._private_channels.get(channel_id)
+        return self._private_channels.get(utils.snowflake(channel_id))
 
     def _get_private_channel_by_user(self, user_id):
-        return self._private_channels_by_user.get(user_id)
+        return self._private_channels_by_user.get(utils.snowflake(user_id))
 
     def _add_private_channel(self, channel):
         self._private_channels[channel.id] = channel
@@ -150,15 +211,109 @@ class ConnectionState:
             self._private_channels_by_user.pop(channel.user.id, None)
 
     def _get_message(self, msg_id):
-        return utils.find(lambda m: m.id == msg_id, self.messages)
+        return self.messages.get(utils.snowflake(msg_id))
+
+    def _snapshot(self, event, obj, key=None):
+        """Returns a copy of ``obj`` to dispatch to ``event`` as its state before
+        an update, or None if nothing handling the event wants it. Events in
+        :attr:`snapshot_factories` are dispatched what their factory returns instead.
+
+        If an update to the object with the given ``key`` is already being
+        coalesced, the copy from the first update is used instead.
+        """
+        if (event, key) in self._coalescing or not self.wants_snapshot(event):
+            return None
+        factory = self.snapshot_factories.get(event)
+        if factory is not None:
+            return factory(obj)
+        copier = getattr(obj, '_copy', None)
+        return copy.copy(obj) if copier is None else copier()
+
+    def _dispatch_coalesced(self, event, key, *args):
+        """Dispatches an event, merging it with later ones for the same key if
+        the event has a coalescing window.
+
+        A merged dispatch happens when the window ends. Its leading arguments
+        (e.g. ``before``) come from the first event in the window, and its last
+        argument from the latest.
+        """
+        window = self.coalesce_windows.get(event)
+        if not window:
+            self.dispatch(event, *args)
+            return
+
+        pending = self._coalescing.get((event, key))
+        if pending is not None:
+            pending[2] = args
+            self.coalesced[event] += 1
+            return
+
+        timer = self.loop.call_later(window, self._flush_coalesced, (event, key))
+        self._coalescing[(event, key)] = [timer, args, args]
+
+    def _flush_coalesced(self, event_key):
+        timer, first, latest = self._coalescing.pop(event_key)
+        timer.cancel()
+        self.dispatch(event_key[0], *first[:-1], *latest[-1:])
+
+    def _cancel_coalesced(self, event_key):
+        pending = self._coalescing.pop(event_key, None)
+        if pending is not None:
+            pending[0].cancel()
+
+    def flush_coalesced(self):
+        """Dispatches every event still waiting in a coalescing window."""
+        for event_key in list(getattr(self, '_coalescing', ())):
+            self._flush_coalesced(event_key)
 
     def _add_server_from_data(self, guild):
         server = Server(**guild)
-        Server.me = property(lambda s: s.get_member(self.user.id))
-        Server.voice_client = property(lambda s: self._get_voice_client(s.id))
+        self._bind_server_properties()
         self._add_server(server)
         return server
 
+    def _bind_server_properties(self):
+        Server.me = property(lambda s: s.get_member(self.user.id))
+        Server.voice_client = property(lambda s: self._get_voice_client(s.id))
+
+    def session_snapshot(self):
+        """Returns the gateway session and the state built from it, in a form
+        which can be pickled and later given to :meth:`restore_session`."""
+        return {
+            'session_id': self.session_id,
+            'sequence': self.sequence,
+            'gateway': self.gateway,
+            'int_ids': self.int_ids,
+            'user': self.user,
+            'servers': list(self.servers),
+            'private_channels': list(self.private_channels),
+        }
+
+    def restore_session(self, snapshot):
+        """Replaces the state with a snapshot from :meth:`session_snapshot`, so that
+        the session can be resumed instead of identifying again.
+
+        Returns False without changing anything if the snapshot's IDs are of a
+        different type from ours.
+        """
+        if snapshot['int_ids'] != self.int_ids:
+            return False
+
+        self.clear()
+        self.session_id = snapshot['session_id']
+        self.sequence = snapshot['sequence']
+        self.gateway = snapshot['gateway']
+        self.user = snapshot['user']
+        self._bind_server_properties()
+        for server in snapshot['servers']:
+            self._add_server(server)
+        for channel in snapshot['private_channels']:
+            for recipient in channel.recipients:
+                self._users.add(recipient)
+            self._add_private_channel(channel)
+        self.restored = True
+        return True
+
     def chunks_needed(self, server):
         for chunk in range(math.ceil(server._member_count / 1000)):
             yield self.receive_chunk(server.id)
@@ -216,7 +371,7 @@ class ConnectionState:
                 servers.append(server)
 
         for pm in data.get('private_channels'):
-            self._add_private_channel(PrivateChannel(self.user, **pm))
+            self._add_private_channel(PrivateChannel(self.user, self._users, **pm))
 
         for pres in data.get('presences'):
             dm = self._get_private_channel_by_user(pres['user']['id'])
@@ -225,32 +380,33 @@ class ConnectionState:
         compat.create_task(self._delay_ready(), loop=self.loop)
 
     def parse_resumed(self, data):
+        self.restored = False
         self.dispatch('resumed')
 
     def parse_message_create(self, data):
+        if data.get('webhook_id') is None:
+            self._users.update(data.get('author', {}))
+        for mention in data.get('mentions', ()):
+            self._users.update(mention)
         channel = self.get_channel(data.get('channel_id'))
         message = self._create_message(channel=channel, **data)
         self.dispatch('message', message)
         self.messages.append(message)
 
     def parse_message_delete(self, data):
-        message_id = data.get('id')
-        found = self._get_message(message_id)
+        message_id = utils.snowflake(data.get('id'))
+        found = self.messages.pop(message_id)
         if found is not None:
             self.dispatch('message_delete', found)
-            self.messages.remove(found)
 
     def parse_message_delete_bulk(self, data):
-        message_ids = set(data.get('ids', []))
-        to_be_deleted = list(filter(lambda m: m.id in message_ids, self.messages))
-        for msg in to_be_deleted:
+        for msg in self.messages.pop_many(map(utils.snowflake, data.get('ids', []))):
             self.dispatch('message_delete', msg)
-            self.messages.remove(msg)
 
     def parse_message_update(self, data):
         message = self._get_message(data.get('id'))
         if message is not None:
-            older_message = copy.copy(message)
+            older_message = self._snapshot('message_edit', message)
             if 'call' in data:
                 # call state message edit
                 message._handle_call(data['call'])
@@ -268,7 +424,7 @@ class ConnectionState:
             emoji = self._get_reaction_emoji(**data.pop('emoji'))
             reaction = utils.get(message.reactions, emoji=emoji)
 
-            is_me = data['user_id'] == self.user.id
+            is_me = utils.snowflake(data['user_id']) == self.user.id
 
             if not reaction:
                 reaction = Reaction(
@@ -303,7 +459,7 @@ class ConnectionState:
                 return
 
             reaction.count -= 1
-            if data['user_id'] == self.user.id:
+            if utils.snowflake(data['user_id']) == self.user.id:
                 reaction.me = False
             if reaction.count == 0:
                 message.reactions.remove(reaction)
@@ -315,15 +471,16 @@ class ConnectionState:
 
     def parse_presence_update(self, data):
         server = self._get_server(data.get('guild_id'))
+        # DM recipients and message authors share the cached user
+        cached_user = self._users.update(data['user'])
         if server is None:
-            user = data['user']
-            dm = self._get_private_channel_by_user(user["id"])
-            if dm:
-                dm.user.status = try_enum(Status, data["status"])
-            self.dispatch('dm_update', dm)
+            if cached_user is not None:
+                cached_user.status = try_enum(Status, data["status"])
+            user_id = utils.snowflake(data['user']['id'])
+            dm = self._get_private_channel_by_user(user_id)
+            self._dispatch_coalesced('dm_update', user_id, dm)
             return
 
-        status = data.get('status')
         user = data['user']
         member_id = user['id']
         member = server.get_member(member_id)
@@ -336,7 +493,7 @@ class ConnectionState:
             member = self._make_member(server, data)
             server._add_member(member)
 
-        old_member = member._copy()
+        old_member = self._snapshot('member_update', member, (server.id, member.id))
         member.status = data.get('status')
         try:
             member.status = Status(member.status)
@@ -349,7 +506,7 @@ class ConnectionState:
         member.avatar = user.get('avatar', member.avatar)
         member.discriminator = user.get('discriminator', member.discriminator)
 
-        self.dispatch('member_update', old_member, member)
+        self._dispatch_coalesced('member_update', (server.id, member.id), old_member, member)
 
     def parse_user_update(self, data):
         self.user = User(**data)
@@ -361,6 +518,7 @@ class ConnectionState:
             channel = server.get_channel(channel_id)
             if channel is not None:
                 server._remove_channel(channel)
+                self._channels.pop(channel.id, None)
                 self.dispatch('channel_delete', channel)
 
     def parse_channel_update(self, data):
@@ -368,7 +526,7 @@ class ConnectionState:
         channel_id = data.get('id')
         if channel_type is ChannelType.group:
             channel = self._get_private_channel(channel_id)
-            old_channel = copy.copy(channel)
+            old_channel = self._snapshot('channel_update', channel)
             channel._update_group(**data)
             self.dispatch('channel_update', old_channel, channel)
             return
@@ -377,7 +535,7 @@ class ConnectionState:
         if server is not None:
             channel = server.get_channel(channel_id)
             if channel is not None:
-                old_channel = copy.copy(channel)
+                old_channel = self._snapshot('channel_update', channel)
                 channel._update(server=server, **data)
                 self.dispatch('channel_update', old_channel, channel)
 
@@ -385,19 +543,20 @@ class ConnectionState:
         ch_type = try_enum(ChannelType, data.get('type'))
         channel = None
         if ch_type in (ChannelType.group, ChannelType.private):
-            channel = PrivateChannel(self.user, **data)
+            channel = PrivateChannel(self.user, self._users, **data)
             self._add_private_channel(channel)
         else:
             server = self._get_server(data.get('guild_id'))
             if server is not None:
                 channel = Channel(server=server, **data)
                 server._add_channel(channel)
+                self._channels[channel.id] = channel
 
         self.dispatch('channel_create', channel)
 
     def parse_channel_recipient_add(self, data):
         channel = self._get_private_channel(data.get('channel_id'))
-        user = User(**data.get('user', {}))
+        user = self._users.get(data.get('user', {}))
         channel.recipients.append(user)
         self.dispatch('group_join', channel, user)
 
@@ -412,13 +571,7 @@ class ConnectionState:
             self.dispatch('group_remove', channel, user)
 
     def _make_member(self, server, data):
-        roles = [server.default_role]
-        for roleid in data.get('roles', []):
-            role = utils.get(server.roles, id=roleid)
-            if role is not None:
-                roles.append(role)
-
-        data['roles'] = sorted(roles)
+        data['roles'] = server._member_roles(data.get('roles', []))
         return Member(server=server, **data)
 
     def parse_guild_member_add(self, data):
@@ -434,6 +587,10 @@ class ConnectionState:
             user_id = data['user']['id']
             member = server.get_member(user_id)
             if member is not None:
+                # an update still being merged is dispatched before the removal
+                event_key = ('member_update', (server.id, member.id))
+                if event_key in self._coalescing:
+                    self._flush_coalesced(event_key)
                 server._remove_member(member)
                 server._member_count -= 1
 
@@ -453,7 +610,7 @@ class ConnectionState:
         member = server.get_member(user_id)
         if member is not None:
             user = data['user']
-            old_member = member._copy()
+            old_member = self._snapshot('member_update', member, (server.id, member.id))
             member.name = user['username']
             member.discriminator = user['discriminator']
             member.avatar = user['avatar']
@@ -465,19 +622,15 @@ class ConnectionState:
                 member.nick = data['nick']
 
             # update the roles
-            member.roles = [server.default_role]
-            for role in server.roles:
-                if role.id in data['roles']:
-                    member.roles.append(role)
-
-            # sort the roles by ID since they can be "randomised"
-            member.roles.sort()
-            self.dispatch('member_update', old_member, member)
+            member.roles = server._member_roles(data['roles'])
+            self._dispatch_coalesced('member_update', (server.id, member.id), old_member, member)
 
     def parse_guild_emojis_update(self, data):
         server = self._get_server(data.get('guild_id'))
         before_emojis = server.emojis
         server.emojis = [Emoji(server=server, **e) for e in data.get('emojis', [])]
+        self._unindex_emojis(before_emojis)
+        self._index_emojis(server.emojis)
         self.dispatch('server_emojis_update', before_emojis, server.emojis)
 
     def _get_create_server(self, data):
@@ -488,7 +641,9 @@ class ConnectionState:
             server = self._get_server(data.get('id'))
             if server is not None:
                 server.unavailable = False
+                self._unindex_server(server)
                 server._from_data(data)
+                self._index_server(server)
                 return server
 
         return self._add_server_from_data(data)
@@ -547,13 +702,17 @@ class ConnectionState:
 
     def parse_guild_sync(self, data):
         server = self._get_server(data.get('id'))
+        self._unindex_server(server)
         server._sync(data)
+        self._index_server(server)
 
     def parse_guild_update(self, data):
         server = self._get_server(data.get('id'))
         if server is not None:
-            old_server = copy.copy(server)
+            old_server = self._snapshot('server_update', server)
+            self._unindex_server(server)
             server._from_data(data)
+            self._index_server(server)
             self.dispatch('server_update', old_server, server)
 
     def parse_guild_delete(self, data):
@@ -569,7 +728,13 @@ class ConnectionState:
             return
 
         # do a cleanup of the messages cache
-        self.messages = deque((msg for msg in self.messages if msg.server != server), maxlen=self.max_messages)
+        self.messages.remove_channels([channel.id for channel in server.channels])
+
+        # updates to its members still being merged are dropped, since they
+        # would be dispatched after the server is gone
+        for event_key in list(self._coalescing):
+            if event_key[0] == 'member_update' and event_key[1][0] == server.id:
+                self._cancel_coalesced(event_key)
 
         self._remove_server(server)
         self.dispatch('server_remove', server)
@@ -583,7 +748,7 @@ class ConnectionState:
         server = self._get_server(data.get('guild_id'))
         if server is not None:
             user_id = data.get('user', {}).get('id')
-            member = utils.get(server.members, id=user_id)
+            member = server.get_member(user_id)
             if member is not None:
                 self.dispatch('member_ban', member)
 
@@ -604,8 +769,7 @@ class ConnectionState:
     def parse_guild_role_delete(self, data):
         server = self._get_server(data.get('guild_id'))
         if server is not None:
-            role_id = data.get('role_id')
-            role = utils.find(lambda r: r.id == role_id, server.roles)
+            role = server.get_role(data.get('role_id'))
             try:
                 server._remove_role(role)
             except ValueError:
@@ -616,45 +780,76 @@ class ConnectionState:
     def parse_guild_role_update(self, data):
         server = self._get_server(data.get('guild_id'))
         if server is not None:
-            role_id = data['role']['id']
-            role = utils.find(lambda r: r.id == role_id, server.roles)
+            role = server.get_role(data['role']['id'])
             if role is not None:
-                old_role = copy.copy(role)
+                old_role = self._snapshot('server_role_update', role)
                 role._update(**data['role'])
+                server._reindex_roles()
                 self.dispatch('server_role_update', old_role, role)
 
     def parse_guild_members_chunk(self, data):
-        log.debug("here")
         server = self._get_server(data.get('guild_id'))
         members = data.get('members', [])
+        if len(members) <= MEMBER_CHUNK_SLICE and self._member_ingestion is None:
+            self._add_members(server, members)
+            self._members_chunk_done(server, len(members))
+            return
+
+        # add large chunks a slice at a time, after any chunk still being added
+        task = compat.create_task(
+            self._ingest_members_chunk(server, members, self._member_ingestion),
+            loop=self.loop
+        )
+        task.add_done_callback(self._member_ingestion_done)
+        self._member_ingestion = task
+
+    async def _ingest_members_chunk(self, server, members, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        for start in range(0, len(members), MEMBER_CHUNK_SLICE):
+            if start:
+                # let heartbeats and other events through
+                await asyncio.sleep(0)
+            self._add_members(server, members[start:start + MEMBER_CHUNK_SLICE])
+        self._members_chunk_done(server, len(members))
+
+    def _member_ingestion_done(self, task):
+        if self._member_ingestion is task:
+            self._member_ingestion = None
+
+    def _add_members(self, server, members):
         for member in members:
             m = self._make_member(server, member)
             existing = server.get_member(m.id)
             if existing is None or existing.joined_at is None:
                 server._add_member(m)
 
+    def _members_chunk_done(self, server, count):
         # if the owner is offline, server.owner is potentially None
         # therefore we should check if this chunk makes it point to a valid
         # member.
         server.owner = server.get_member(server.owner_id)
-        log.info('processed a chunk for {} members.'.format(len(members)))
-        self.process_listeners(ListenerType.chunk, server, len(members))
+        log.info('processed a chunk for {} members.'.format(count))
+        self.process_listeners(ListenerType.chunk, server, count, key=server.id)
 
     def parse_voice_state_update(self, data):
         server = self._get_server(data.get('guild_id'))
         if server is not None:
             channel = server.get_channel(data.get('channel_id'))
-            if data.get('user_id') == self.user.id:
+            if utils.snowflake(data.get('user_id')) == self.user.id:
                 voice = self._get_voice_client(server.id)
                 if voice is not None:
                     voice.channel = channel
 
-            before, after = server._update_voice_state(data)
+            before, after = server._update_voice_state(
+                data,
+                snapshot=self.wants_snapshot('voice_state_update')
+            )
             if after is not None:
                 self.dispatch('voice_state_update', before, after)
         else:
             # in here we're either at private or group calls
-            call = self._calls.get(data.get('channel_id'), None)
+            call = self._calls.get(utils.snowflake(data.get('channel_id')), None)
             if call is not None:
                 call._update_voice_state(data)
 
@@ -680,22 +875,23 @@ class ConnectionState:
         message = self._get_message(data.get('message_id'))
         if message is not None:
             call = GroupCall(call=message, **data)
-            self._calls[data['channel_id']] = call
+            self._calls[call.channel.id] = call
             self.dispatch('call', call)
 
     def parse_call_update(self, data):
-        call = self._calls.get(data.get('channel_id'), None)
+        call = self._calls.get(utils.snowflake(data.get('channel_id')), None)
         if call is not None:
-            before = copy.copy(call)
+            before = self._snapshot('call_update', call)
             call._update(**data)
             self.dispatch('call_update', before, call)
 
     def parse_call_delete(self, data):
-        call = self._calls.pop(data.get('channel_id'), None)
+        call = self._calls.pop(utils.snowflake(data.get('channel_id')), None)
         if call is not None:
             self.dispatch('call_remove', call)
 
     def _get_member(self, channel, id):
+        id = utils.snowflake(id)
         if channel.is_private:
             if id == self.user.id:
                 return self.user
@@ -709,7 +905,7 @@ class ConnectionState:
             self._create_reaction(**r) for r in message.pop('reactions', [])
         ]
         return Message(channel=message.pop('channel'),
-                       reactions=reactions, **message)
+                       reactions=reactions, users=self._users, **message)
 
     def _create_reaction(self, **reaction):
         emoji = self._get_reaction_emoji(**reaction.pop('emoji'))
@@ -721,27 +917,24 @@ class ConnectionState:
         if not id:
             return data['name']
 
-        for server in self.servers:
-            for emoji in server.emojis:
-                if emoji.id == id:
-                    return emoji
+        emoji = self._emojis.get(utils.snowflake(id))
+        if emoji is not None:
+            return emoji
         return Emoji(server=None, **data)
 
     def get_channel(self, id):
         if id is None:
             return None
 
-        for server in self.servers:
-            channel = server.get_channel(id)
-            if channel is not None:
-                return channel
+        id = utils.snowflake(id)
+        channel = self._channels.get(id)
+        if channel is not None:
+            return channel
 
-        pm = self._get_private_channel(id)
-        if pm is not None:
-            return pm
+        return self._private_channels.get(id)
 
     def receive_chunk(self, guild_id):
         future = asyncio.Future(loop=self.loop)
         listener = Listener(ListenerType.chunk, future, lambda s: s.id == guild_id)
-        self._listeners.append(listener)
+        self._listeners.add((ListenerType.chunk, guild_id), future, listener)
         return future
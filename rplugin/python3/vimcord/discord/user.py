@@ -24,9 +24,12 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
+from . import utils
 from .utils import snowflake_time
 from .enums import DefaultAvatar, Status
 
+import weakref
+
 class User:
     """Represents a Discord user.
 
@@ -58,16 +61,22 @@ class User:
         Specifies if the user is a bot account.
     """
 
-    __slots__ = ['name', 'id', 'discriminator', 'avatar', 'bot', 'status']
+    __slots__ = ['name', 'id', 'discriminator', 'avatar', 'bot', 'status', '__weakref__']
 
     def __init__(self, **kwargs):
         self.name = kwargs.get('username')
-        self.id = kwargs.get('id')
+        self.id = utils.snowflake(kwargs.get('id'))
         self.status = Status.offline
         self.discriminator = kwargs.get('discriminator')
         self.avatar = kwargs.get('avatar')
         self.bot = kwargs.get('bot', False)
 
+    def _update(self, data):
+        self.name = data.get('username', self.name)
+        self.discriminator = data.get('discriminator', self.discriminator)
+        self.avatar = data.get('avatar', self.avatar)
+        self.bot = data.get('bot', self.bot)
+
     def __str__(self):
         return '{0.name}#{0.discriminator}'.format(self)
 
@@ -157,3 +166,42 @@ class User:
             return True
 
         return False
+
+class UserCache:
+    """Shares one :class:`User` between every object which refers to the same user,
+    instead of building a new one from each payload.
+
+    A user is only kept while something else (e.g., a message) refers to it.
+    """
+
+    def __init__(self):
+        self._users = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, data, update=True):
+        """Returns the user with the ID in the user payload ``data``, creating it if
+        it is not known. A known user is updated from ``data``, unless ``update``
+        is false because the payload may be older than what the user has seen."""
+        user = self._users.get(utils.snowflake(data.get('id')))
+        if user is None:
+            user = User(**data)
+            if user.id is not None:
+                self._users[user.id] = user
+        elif update:
+            user._update(data)
+        return user
+
+    def add(self, user):
+        """Shares an existing :class:`User`, such as one restored from disk, unless
+        a user with the same ID is already known. Returns the shared user."""
+        return self._users.setdefault(user.id, user)
+
+    def update(self, data):
+        """Updates the user with the ID in the user payload ``data``. Returns the user,
+        or None if it is not known."""
+        user = self._users.get(utils.snowflake(data.get('id')))
+        if user is not None:
+            user._update(data)
+        return user
@@ -25,13 +25,23 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from re import split as re_split
-from .errors import HTTPException, Forbidden, NotFound, InvalidArgument
+from .errors import HTTPException, Forbidden, NotFound, InvalidArgument, ClientException
 import datetime
 from base64 import b64encode
 import asyncio
 import json
 import warnings, functools
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 DISCORD_EPOCH = 1420070400000
 
 class cached_property:
@@ -65,6 +75,9 @@ class CachedSlotProperty:
             setattr(instance, self.name, value)
             return value
 
+    def __set__(self, instance, value):
+        setattr(instance, self.name, value)
+
 def cached_slot_property(name):
     def decorator(func):
         return CachedSlotProperty(name, func)
@@ -248,6 +261,54 @@ def _bytes_to_base64_data(data):
     b64 = b64encode(data).decode('ascii')
     return fmt.format(mime=mime, data=b64)
 
-def to_json(obj):
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode('utf-8')
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False)
+
+def _json_dumps(obj):
     return json.dumps(obj, separators=(',', ':'), ensure_ascii=True)
 
+# the installed JSON backends, fastest first. Each maps to a function which
+# encodes an object to a str and one which decodes a str or UTF-8 bytes.
+JSON_CODECS = {}
+if orjson is not None:
+    JSON_CODECS['orjson'] = (_orjson_dumps, orjson.loads)
+if ujson is not None:
+    JSON_CODECS['ujson'] = (_ujson_dumps, ujson.loads)
+JSON_CODECS['json'] = (_json_dumps, json.loads)
+
+JSON_BACKEND = next(iter(JSON_CODECS))
+to_json, from_json = JSON_CODECS[JSON_BACKEND]
+
+def _keep_snowflake(value):
+    return value
+
+def _int_snowflake(value):
+    if value.__class__ is str and value.isdigit():
+        return int(value)
+    return value
+
+# converts an ID from a payload (or one given by the user) to the type IDs are
+# stored as. Models and cache lookups call this where they read an ID, so that
+# payloads never need a separate pass. See :func:`use_int_ids`.
+snowflake = _keep_snowflake
+# whether IDs are stored as integers, once a client has chosen
+_int_ids = None
+
+def use_int_ids(enabled):
+    """Sets whether IDs are stored as integers instead of strings.
+
+    Models have no reference to a client, so this applies to the whole
+    process. The first client to call this chooses the mode, and a later
+    one asking for the other mode raises :exc:`ClientException` rather
+    than changing how the first one's IDs are looked up.
+    """
+    global snowflake, _int_ids
+    if _int_ids is not None:
+        if _int_ids != enabled:
+            raise ClientException('IDs are already stored as {}'.format('integers' if _int_ids else 'strings'))
+        return
+    _int_ids = enabled
+    snowflake = _int_snowflake if enabled else _keep_snowflake
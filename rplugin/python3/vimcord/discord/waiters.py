@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2015-2016 Rapptz
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+
+import functools
+
+class WaiterRegistry:
+    """Futures waiting for events, grouped by a key such as the event type.
+
+    When an event happens, only the futures under its key need to be checked.
+    A future is removed from the registry as soon as it is done, including when
+    it is cancelled or times out, so abandoned waiters do not pile up.
+    """
+
+    def __init__(self):
+        # key -> {future: entry}
+        self._waiters = {}
+
+    def __len__(self):
+        return sum(map(len, self._waiters.values()))
+
+    def add(self, key, future, entry):
+        """Registers ``future`` under ``key``, along with an ``entry`` describing
+        what it is waiting for."""
+        self._waiters.setdefault(key, {})[future] = entry
+        future.add_done_callback(functools.partial(self.remove, key))
+
+    def remove(self, key, future):
+        """Removes ``future`` from under ``key``, if it is there."""
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            return
+        waiters.pop(future, None)
+        if not waiters:
+            del self._waiters[key]
+
+    def waiting(self, key):
+        """Returns a list of ``(future, entry)`` for the futures under ``key``
+        which are not done, in the order they were added."""
+        waiters = self._waiters.get(key)
+        if not waiters:
+            return []
+        return [(future, entry) for future, entry in waiters.items() if not future.done()]
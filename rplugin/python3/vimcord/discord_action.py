@@ -3,12 +3,16 @@ import logging
 import re
 
 # from vimcord.discord import errors as discord_errors
+from vimcord.bridge import vim_id
 from vimcord.formatting import format_channel
 from vimcord.pickle_pipe import ForwardedException
 
 log = logging.getLogger(__name__)
 log.setLevel("DEBUG")
 
+# seconds to wait for the daemon to report the connection state before assuming it's disconnected
+CONNECTION_STATE_TIMEOUT = 10
+
 def parse_mentions(text, server):
     '''Convert all literal @s into semantic ones for discord'''
     if server is None:
@@ -51,7 +55,7 @@ class DiscordAction:
         The latter value is a list of filenames to send along with the message.
         Only the first entry is actually sent, due to library limitations.
         '''
-        channel_id = message_data.get("channel_id")
+        channel_id = self.bridge.parse_id(message_data.get("channel_id"))
         channel = await self.discord.awaitable.get_channel(channel_id)
         if channel is None:
             self.plugin.notify("Cannot send message: could not find channel")
@@ -70,7 +74,7 @@ class DiscordAction:
 
         # make sure we have a reference prepared
         is_reply = message_data.get("is_reply", False)
-        message_id = message_data.get("message_id")
+        message_id = self.bridge.parse_id(message_data.get("message_id"))
         reference = {
             "channel_id": channel_id,
             "message_id": message_id,
@@ -113,7 +117,7 @@ class DiscordAction:
         If the message can be found, this sends the message contents to vim, which are
         replaced in the reply buffer. When submitted, `do_edit` should be called.
         '''
-        message_id = message_data.get("message_id")
+        message_id = self.bridge.parse_id(message_data.get("message_id"))
 
         if (message := self.bridge.all_messages.get(message_id)) is None:
             self.plugin.notify("Cannot edit: could not find message")
@@ -140,8 +144,8 @@ class DiscordAction:
         `content` is a dict containing the field "content", which is a string containing
         the edited message contents to send to Discord.
         '''
-        channel_id = message_data.get("channel_id")
-        message_id = message_data.get("message_id")
+        channel_id = self.bridge.parse_id(message_data.get("channel_id"))
+        message_id = self.bridge.parse_id(message_data.get("message_id"))
         # we already checked this in "tryedit" according to the normal flow,
         # so this shouldn't happen
         if (message := self.bridge.all_messages.get(message_id)) is None:
@@ -161,7 +165,7 @@ class DiscordAction:
 
         # ...and server
         server = next(
-            filter(lambda x: x.id == message_data["server_id"], self.bridge._servers),
+            filter(lambda x: x.id == self.bridge.parse_id(message_data["server_id"]), self.bridge._servers),
             None
         ) if getattr(channel, "server", None) is not None else "DM"
         if server is None:
@@ -181,8 +185,8 @@ class DiscordAction:
         It must contain the fields "message_id" and "channel_id", which are the the ID of the
         Discord message being edited and the channel it belongs to.
         '''
-        message_id = message_data.get("message_id")
-        channel_id = message_data.get("channel_id")
+        message_id = self.bridge.parse_id(message_data.get("message_id"))
+        channel_id = self.bridge.parse_id(message_data.get("channel_id"))
 
         if message_id is None:
             self.plugin.notify("Cannot delete message: line has no message ID!")
@@ -205,9 +209,9 @@ class DiscordAction:
 
     async def try_direct_message(self, message_data):
         if isinstance(message_data, dict) and "message_id" in message_data is not None:
-            message_id = message_data["message_id"]
+            message_id = self.bridge.parse_id(message_data["message_id"])
         elif isinstance(message_data, int):
-            message_id = message_data
+            message_id = self.bridge.parse_id(message_data)
         else:
             self.plugin.notify("Cannot direct message: received bad message data!")
             return
@@ -234,7 +238,7 @@ class DiscordAction:
         self.plugin.nvim.async_call(
             self.plugin.nvim.api.call_function,
             "vimcord#discord#action#simple_reply",
-            [{"channel_id": channel_id}]
+            [{"channel_id": vim_id(channel_id)}]
          )
 
     async def try_reconnect(self):
@@ -249,12 +253,12 @@ class DiscordAction:
     def get_channel_members(self, channel_id):
         if (channel := self.bridge.get_channel(channel_id)) is None:
             return []
-        return self.bridge.all_members.get(channel.server.id, [])
+        return self.bridge.all_members.get(vim_id(channel.server.id), [])
 
     def get_channel_names(self, channel_id=None):
         if channel_id is None:
             return self.bridge.all_channel_names
-        return self.bridge.all_channel_names.get(channel_id, "")
+        return self.bridge.all_channel_names.get(vim_id(channel_id), "")
 
     def get_unmuted_channel_names(self):
         return self.bridge.unmuted_channel_names
@@ -262,9 +266,12 @@ class DiscordAction:
     async def get_connection_state(self):
         daemon_conneceted = self.discord.transport is not None
         try:
-            is_not_connected = await self.discord.awaitable.is_closed()
-            is_logged_in = await self.discord.awaitable.is_logged_in()
-            session_closed = await self.discord.awaitable.http.session.closed()
+            is_not_connected, is_logged_in, session_closed = await self.discord.wait_for_many(
+                self.discord.call.is_closed(),
+                self.discord.call.is_logged_in(),
+                self.discord.call.http.session.closed(),
+                timeout=CONNECTION_STATE_TIMEOUT,
+            )
         except:
             is_not_connected = True
             is_logged_in = False
@@ -42,6 +42,9 @@ async def connect_to_daemon(path, log):
             await asyncio.sleep(1)
     log.info("Connected to daemon process!")
 
+    framing = await ret.negotiate()
+    log.info("Using framing %d", framing)
+
     return not server_running, ret
 
 def kill_server(path):
@@ -3,6 +3,7 @@ import os
 import os.path
 import logging
 import logging.handlers
+import signal
 import sys
 import traceback
 
@@ -13,7 +14,7 @@ log = logging.getLogger(__package__)
 log.setLevel("ERROR")
 pickle_pipe.log.setLevel("ERROR")
 
-CREATED_PROTOCOLS = []
+BROADCASTER = pickle_pipe.EventBroadcaster()
 
 def _handle_exception(loop, context):
     exception = context.get("exception")
@@ -29,17 +30,12 @@ def _handle_exception(loop, context):
     else:
         formatted = "(Could not get stack trace)"
     # broadcast the error to clients (i.e., so they can tell it to reconnect)
-    deletions = []
-    for i, protocol in enumerate(CREATED_PROTOCOLS):
+    for protocol in BROADCASTER.protocols:
         if protocol.transport is None or protocol.transport.is_closing():
-            deletions.append(i)
             continue
         if (exc := context.get("exception")) is not None:
             protocol.write_error(exc)
 
-    for deletion in reversed(deletions):
-        del CREATED_PROTOCOLS[deletion]
-
 DISCORD_EVENT_NAMES = [
     "call",
     "call_remove",
@@ -65,6 +61,7 @@ DISCORD_EVENT_NAMES = [
     "remote_update", # not a Discord event; used to send daemon data to clients
     "resumed",
     "servers_ready",
+    "state_delta", # not a Discord event; changes to state replicated to clients
     "server_available",
     "server_emojis_update",
     "server_join",
@@ -78,23 +75,67 @@ DISCORD_EVENT_NAMES = [
     "voice_state_update",
 ]
 
-def bind_discord_pickle(discord_client):
-    protocol = pickle_pipe.PickleServerProtocol(discord_client)
+# events dispatched with the object before and after an update. Only the updated object is forwarded
+UPDATE_EVENT_NAMES = [
+    "call_update",
+    "channel_update",
+    "member_update",
+    "message_edit",
+    "server_role_update",
+    "server_update",
+    "voice_state_update",
+]
 
+def _forward_updated(handler):
+    async def forward_updated(before, after):
+        await handler(after)
+    return forward_updated
+
+def bind_discord_events(discord_client):
+    '''Forward Discord events from the client to every attached pipe client'''
     for e in DISCORD_EVENT_NAMES:
         if isinstance(e, tuple):
             event_name, discord_event_name = e
         else:
             event_name, discord_event_name = e, "on_" + e
-        handler = protocol.get_event_handler(event_name)
+        handler = BROADCASTER.get_event_handler(event_name)
+        if event_name in UPDATE_EVENT_NAMES:
+            handler = _forward_updated(handler)
+        # clients are never sent the state before an update, so don't copy it
+        handler.needs_before = False
         handler.__name__ = discord_event_name
         discord_client.event(handler)
 
-    CREATED_PROTOCOLS.append(protocol)
-    return protocol
+def bind_discord_pickle(discord_client):
+    return pickle_pipe.PickleServerProtocol(discord_client, BROADCASTER)
+
+def _terminate(client):
+    '''
+    Exit on SIGTERM, saving the Discord session for the next daemon to resume.
+    The websocket is left open, since closing it normally ends the session.
+    '''
+    try:
+        client.save_session()
+    except Exception as e:
+        log.error("Could not save session: %s", e)
+    raise SystemExit
+
+def _session_path(pipe_file):
+    '''
+    Where the Discord session is saved between daemons: in a private directory under
+    $XDG_RUNTIME_DIR, or in the pipe directory if it is not set
+    '''
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        return os.path.join(pipe_file, "session")
+    session_dir = os.path.join(runtime_dir, "vimcord")
+    os.makedirs(session_dir, mode=0o700, exist_ok=True)
+    return os.path.join(session_dir, "session")
 
 async def _start_server(pipe_file):
-    client = VimcordClient()
+    client = VimcordClient(session_path=_session_path(pipe_file))
+    bind_discord_events(client)
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, _terminate, client)
     server = await asyncio.get_event_loop().create_unix_server(
         lambda: bind_discord_pickle(client),
         path=os.path.join(pipe_file, "socket")
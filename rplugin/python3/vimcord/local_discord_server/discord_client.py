@@ -1,15 +1,43 @@
 import asyncio
 import logging
 import json
+import os
+import pickle
+import stat
 import time
 
 import vimcord.discord as discord
+from vimcord.local_discord_server import replication
 
 log = logging.getLogger(__name__)
 log.setLevel("DEBUG")
 
+# messages cached for any one channel
+MAX_MESSAGES_PER_CHANNEL = 1000
+# messages each channel keeps when busier channels need room in the cache
+CHANNEL_MESSAGE_RESERVE = 100
+# whether Discord IDs are stored as integers instead of strings.
+# Clients convert IDs to strings before sending them to vim either way
+INTEGER_IDS = False
+# seconds over which repeated updates to the same member are dispatched (and sent to clients) once
+COALESCE_WINDOWS = {
+    "member_update": 0.5,
+    "dm_update": 0.5,
+}
+# seconds after the daemon exits that the next daemon tries to resume its session
+SESSION_MAX_AGE = 300
+
+def _is_private(stat_result):
+    '''Whether a file is owned by this user, and no one else can write to it'''
+    return stat_result.st_uid == os.getuid() \
+        and not stat_result.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
 class VimcordClient(discord.Client):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, session_path=None, **kwargs):
+        kwargs.setdefault("max_messages_per_channel", MAX_MESSAGES_PER_CHANNEL)
+        kwargs.setdefault("channel_message_reserve", CHANNEL_MESSAGE_RESERVE)
+        kwargs.setdefault("int_ids", INTEGER_IDS)
+        kwargs.setdefault("coalesce_windows", COALESCE_WINDOWS)
         super().__init__(*args, **kwargs)
 
         self._logger = log
@@ -19,9 +47,18 @@ class VimcordClient(discord.Client):
         #keys are server ids, values are dicts of server data
         self._notify = {}
         self._dm_ordering = {}
+        # incremented for every state_delta event sent
+        self._state_version = 0
+        # where the session is saved for the next daemon to resume
+        self._session_path = session_path
+        # session restored from disk, until it is resumed
+        self._restored = None
 
         setattr(self.connection, "parse_guild_members_chunk", self.parse_guild_members_chunk)
         setattr(self.connection, "parse_user_guild_settings_update", self.parse_user_guild_settings_update)
+        self.connection.build_parsers()
+        # deltas only need to know which displayed attributes an update changed
+        self.connection.snapshot_factories.update(replication.SNAPSHOT_EVENTS)
 
     async def get_new_servers(self):
         '''Launch request to get new server settings'''
@@ -42,10 +79,11 @@ class VimcordClient(discord.Client):
                 settings = {"muted": False}
 
             # dictify by channel id
-            settings["channel_overrides"] = {channel["channel_id"]: channel \
+            settings["channel_overrides"] = {discord.utils.snowflake(channel["channel_id"]): channel \
                 for channel in settings.get("channel_overrides", [])}
 
             self._notify[server.id] = settings
+            self._publish_state(replication.DELTA_SETTINGS, replication.CHANGED, server.id, settings)
 
         self._getting_servers = False
         self._need_servers = False
@@ -67,25 +105,200 @@ class VimcordClient(discord.Client):
     def parse_user_guild_settings_update(self, data):
         '''Get new mute/notification data'''
         log.debug("Got guild user settings")
-        guild_id = data.get("guild_id")
+        guild_id = discord.utils.snowflake(data.get("guild_id"))
 
         # dictify by channel id
-        data["channel_overrides"] = {channel["channel_id"]: channel \
+        data["channel_overrides"] = {discord.utils.snowflake(channel["channel_id"]): channel \
             for channel in data.get("channel_overrides", [])}
 
         self._notify[guild_id] = data
+        self._publish_state(replication.DELTA_SETTINGS, replication.CHANGED, guild_id, data)
+        # for clients which do not apply state deltas
         self.dispatch("remote_update")
 
+    def save_session(self):
+        '''
+        Save the gateway session and the state built from it, so that the next daemon
+        can resume it instead of identifying again. Returns whether it was saved.
+        '''
+        if self._session_path is None or not self._really_connected \
+                or self.connection.session_id is None:
+            return False
+        if not self._session_dir_is_private():
+            return False
+
+        session = {
+            "saved_at": time.time(),
+            "connection": self.connection.session_snapshot(),
+            "notify": self._notify,
+            "dm_ordering": self._dm_ordering,
+        }
+        # the session ID is a credential, so only we can read it
+        temp_path = self._session_path + ".tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, "wb") as session_file:
+            pickle.dump(session, session_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self._session_path)
+        log.info("Saved session at sequence %s", self.connection.sequence)
+        return True
+
+    def load_session(self):
+        '''
+        Restore the session saved by a previous daemon, if it is recent enough to resume.
+        The saved session is removed either way, since it can only be resumed once.
+
+        Unpickling runs arbitrary code, so the session is only loaded if this user
+        owns it and its directory, and no one else can write to either.
+        '''
+        if self._session_path is None or not self._session_dir_is_private():
+            return False
+        try:
+            fd = os.open(self._session_path, os.O_RDONLY | os.O_NOFOLLOW)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            log.error("Could not open saved session: %s", e)
+            return False
+
+        session = None
+        try:
+            with os.fdopen(fd, "rb") as session_file:
+                if _is_private(os.fstat(session_file.fileno())):
+                    session = pickle.load(session_file)
+                else:
+                    log.error("Saved session %s is not private; not loading it", self._session_path)
+        except Exception as e:
+            log.error("Could not load saved session: %s", e)
+        finally:
+            os.remove(self._session_path)
+
+        if session is None:
+            return False
+        age = time.time() - session["saved_at"]
+        if age > SESSION_MAX_AGE:
+            log.info("Saved session is too old to resume (%d seconds)", age)
+            return False
+        if not self.connection.restore_session(session["connection"]):
+            log.info("Saved session has a different type of ID; not resuming")
+            return False
+
+        log.info("Restored session at sequence %s", self.connection.sequence)
+        self._restored = session
+        return True
+
+    def _session_dir_is_private(self):
+        session_dir = os.path.dirname(self._session_path) or "."
+        try:
+            dir_stat = os.stat(session_dir)
+        except OSError as e:
+            log.error("Could not check session directory: %s", e)
+            return False
+        if not _is_private(dir_stat):
+            log.error("Session directory %s is not private; not saving or loading sessions", session_dir)
+            return False
+        return True
+
+    async def connect(self, *, resume=False):
+        '''Connect to Discord, resuming the session saved by the last daemon if possible'''
+        if not resume:
+            resume = self.load_session()
+        await super().connect(resume=resume)
+
+    def handle_resumed(self):
+        '''Finish restoring a saved session, now that Discord has resumed it'''
+        super().handle_resumed()
+        if self._restored is None:
+            return
+
+        self._notify = self._restored["notify"]
+        self._dm_ordering = self._restored["dm_ordering"]
+        self._restored = None
+        self._need_servers = False
+        self._really_connected = True
+        log.debug("Resumed saved session")
+        self.dispatch("servers_ready")
+        self.dispatch("really_ready")
+
     async def on_ready(self):
         '''Get DM orderings'''
+        # a new session was started, so a restored one will not be resumed
+        self._restored = None
         direct_messages = await self.http.request(
             discord.http.Route("GET", "/users/@me/channels")
         )
         for channel in direct_messages:
-            self._dm_ordering[channel["id"]] = channel["last_message_id"]
+            channel_id = discord.utils.snowflake(channel["id"])
+            self._dm_ordering[channel_id] = channel["last_message_id"]
+            self._publish_state(
+                replication.DELTA_DM_ORDERING,
+                replication.CHANGED,
+                channel_id,
+                channel["last_message_id"]
+            )
         self._really_connected = True
         self.dispatch("really_ready")
 
+    def dispatch(self, event, *args, **kwargs):
+        '''Dispatch an event, along with deltas for any state it changed'''
+        super().dispatch(event, *args, **kwargs)
+        for delta in replication.deltas_for_event(event, args):
+            self._publish_state(*delta)
+
+    def _wants_snapshot(self, event):
+        return event in replication.SNAPSHOT_EVENTS or super()._wants_snapshot(event)
+
+    def _publish_state(self, kind, op, key, value):
+        self._state_version += 1
+        super().dispatch("state_delta", self._state_version, kind, op, key, value)
+
+    def messages_newest_first(self, channel_ids=None):
+        '''
+        Iterate over the cached messages from newest to oldest, for streaming to clients.
+        If `channel_ids` is given, only messages in those channels are included.
+        '''
+        # copy first, since messages can arrive between pages
+        if channel_ids is None:
+            return reversed(list(self.connection.messages))
+        channel_ids = set(channel_ids)
+        return [message
+            for message in reversed(self.connection.messages)
+            if getattr(message.channel, "id", None) in channel_ids]
+
+    def channel_messages(self, channel_id):
+        '''Iterate over the cached messages in a channel from newest to oldest'''
+        return reversed(list(self.connection.messages.in_channel(channel_id)))
+
+    def state_snapshot(self):
+        '''Get the state replicated to clients, along with the version of the last delta it includes'''
+        return [
+            self._state_version,
+            self.user,
+            self._dm_ordering,
+            self._notify,
+            list(self.servers),
+            list(self.private_channels),
+        ]
+
+    def latency_stats(self):
+        '''
+        Get the round trip times of gateway heartbeats, in seconds, as a dict of the
+        latest, the mean and the history (oldest first), for diagnosing slow delivery.
+        The latest and the mean are None until a heartbeat is acknowledged
+        '''
+        history = self.latencies
+        return {
+            "latest": self.latency,
+            "mean": sum(history) / len(history) if history else None,
+            "history": history,
+        }
+
+    def coalesced_counts(self):
+        '''
+        Get the number of updates which were merged into another instead of being
+        dispatched (see COALESCE_WINDOWS), by event name, for diagnosing update floods
+        '''
+        return dict(self.connection.coalesced)
+
     def set_logging_level(self, level):
         '''Method to set the logging levels (for exmample, from a client to the daemon)'''
         if isinstance(logging.getLevelName(level), int):
@@ -0,0 +1,251 @@
+'''
+replication.py
+
+Keeps a copy of the daemon's account state (servers, channels, members, roles
+and notification settings) up-to-date in clients.
+
+Clients get a snapshot of the state when they attach. Afterward, the daemon
+sends a "state_delta" event whenever part of it changes, of the form
+`(version, kind, op, key, value)`. Versions increase by one for every delta,
+so a client which missed one can tell, and ask for a new snapshot.
+'''
+import copy
+import logging
+
+log = logging.getLogger(__name__)
+log.setLevel("ERROR")
+
+# kinds of state which deltas can change
+DELTA_SETTINGS = "settings"
+DELTA_DM_ORDERING = "dm_ordering"
+DELTA_SERVER = "server"
+DELTA_CHANNEL = "channel"
+DELTA_MEMBER = "member"
+DELTA_ROLE = "role"
+DELTA_EMOJIS = "emojis"
+
+# operations on the state
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+# member attributes that clients display. Changes to anything else (i.e., presence) are not sent
+MEMBER_ATTRIBUTES = ("name", "discriminator", "avatar", "nick", "bot")
+
+# server attributes which refer to other objects, and are not copied by a server delta
+SERVER_GRAPH_ATTRIBUTES = (
+    "_members", "_channels", "roles", "emojis", "owner", "afk_channel",
+    "_default_role", "_default_channel", "_role_index", "_interned_roles",
+)
+
+def _detached_channel(channel):
+    '''Copy of a channel which refers to a stub of its server, but keeps its permission overwrites'''
+    if getattr(channel, "server", None) is None:
+        return channel
+    ret = copy.copy(channel)
+    ret.server = channel.server._transfer_stub()
+    ret.voice_members = []
+    return ret
+
+def _channel_key(channel):
+    server = getattr(channel, "server", None)
+    return (server.id if server is not None else None, channel.id)
+
+def member_key(member):
+    '''The attributes of a member that clients display, to tell whether an update changed them'''
+    # members' roles are replaced rather than modified, so the tuple can be kept as-is
+    return (*(getattr(member, attr, None) for attr in MEMBER_ATTRIBUTES), member.roles)
+
+def _member_changed(before, after):
+    '''Whether a member changed, given `member_key` of it before the update'''
+    if before is None:
+        return True
+    *attrs, roles = before
+    return attrs != [getattr(after, attr, None) for attr in MEMBER_ATTRIBUTES] \
+        or [role.id for role in roles] != [role.id for role in after.roles]
+
+# events whose deltas depend on the state before the update, and the function which
+# captures what they need from the updated object, in place of a copy of it
+SNAPSHOT_EVENTS = {
+    "member_update": member_key,
+}
+
+def deltas_for_event(event, args):
+    '''Yield `(kind, op, key, value)` for the parts of the state changed by a Discord event'''
+    if event in ("server_join", "server_available"):
+        server, = args
+        yield DELTA_SERVER, ADDED, server.id, server
+    elif event in ("server_update", "server_unavailable"):
+        server = args[-1]
+        yield DELTA_SERVER, CHANGED, server.id, server._transfer_stub()
+    elif event == "server_remove":
+        server, = args
+        yield DELTA_SERVER, REMOVED, server.id, None
+    elif event == "channel_create":
+        channel, = args
+        if channel is not None:
+            yield DELTA_CHANNEL, ADDED, _channel_key(channel), _detached_channel(channel)
+    elif event in ("channel_update", "group_join", "group_remove"):
+        channel = args[-1] if event == "channel_update" else args[0]
+        yield DELTA_CHANNEL, CHANGED, _channel_key(channel), _detached_channel(channel)
+    elif event == "channel_delete":
+        channel, = args
+        yield DELTA_CHANNEL, REMOVED, _channel_key(channel), None
+    elif event == "member_join":
+        member, = args
+        yield DELTA_MEMBER, ADDED, (member.server.id, member.id), \
+            member._transfer_stub(member.server._transfer_stub())
+    elif event == "member_update":
+        before, member = args
+        if _member_changed(before, member):
+            yield DELTA_MEMBER, CHANGED, (member.server.id, member.id), \
+                member._transfer_stub(member.server._transfer_stub())
+    elif event == "member_remove":
+        member, = args
+        yield DELTA_MEMBER, REMOVED, (member.server.id, member.id), None
+    elif event in ("server_role_create", "server_role_update"):
+        role = args[-1]
+        op = ADDED if event == "server_role_create" else CHANGED
+        yield DELTA_ROLE, op, (role.server.id, role.id), \
+            role._transfer_stub(role.server._transfer_stub())
+    elif event == "server_role_delete":
+        role, = args
+        yield DELTA_ROLE, REMOVED, (role.server.id, role.id), None
+    elif event == "server_emojis_update":
+        before, emojis = args
+        if emojis or before:
+            server = (emojis or before)[0].server
+            stub = server._transfer_stub()
+            yield DELTA_EMOJIS, CHANGED, server.id, [emoji._transfer_stub(stub) for emoji in emojis]
+
+class StateMirror:
+    '''
+    Client-side copy of the daemon's account state.
+    Loaded from a snapshot with `load`, then kept up-to-date with `apply`.
+    '''
+    def __init__(self):
+        self.version = None
+        self.user = None
+        self.dm_ordering = {}
+        self.notify = {}
+        self.servers = []
+        self.private_channels = []
+
+    def load(self, version, user, dm_ordering, notify, servers, private_channels):
+        '''
+        Replace the state with a snapshot from the daemon.
+        If `version` is None, the daemon does not send deltas.
+        '''
+        self.version = version
+        self.user = user
+        self.dm_ordering = dm_ordering
+        self.notify = notify
+        self.servers = servers
+        self.private_channels = private_channels
+
+    def get_server(self, server_id):
+        for server in self.servers:
+            if server.id == server_id:
+                return server
+        raise KeyError(server_id)
+
+    def apply(self, version, kind, op, key, value):
+        '''
+        Apply a delta from the daemon.
+        Returns False if a delta was missed, in which case a new snapshot should be loaded.
+        '''
+        if self.version is None or version <= self.version:
+            # either there is no up-to-date snapshot, or the snapshot already includes the change
+            return True
+        if version != self.version + 1:
+            log.info("Expected state version %d, got %d", self.version + 1, version)
+            # ignore further deltas until a new snapshot is loaded
+            self.version = None
+            return False
+
+        try:
+            getattr(self, "_apply_" + kind)(op, key, value)
+        except (KeyError, ValueError, AttributeError) as e:
+            log.info("Could not apply %s delta to %s: %r", kind, key, e)
+            self.version = None
+            return False
+        self.version = version
+        return True
+
+    def _apply_settings(self, op, server_id, settings):
+        self.notify[server_id] = settings
+
+    def _apply_dm_ordering(self, op, channel_id, last_message_id):
+        self.dm_ordering[channel_id] = last_message_id
+
+    def _apply_server(self, op, server_id, server):
+        if op == ADDED:
+            self.servers = [i for i in self.servers if i.id != server_id] + [server]
+            return
+        local = self.get_server(server_id)
+        if op == REMOVED:
+            self.servers.remove(local)
+            return
+
+        for attr in type(server).__slots__:
+            if attr in SERVER_GRAPH_ATTRIBUTES or not hasattr(server, attr):
+                continue
+            setattr(local, attr, getattr(server, attr))
+        local._reindex_roles()
+        local.owner = local.get_member(local.owner_id)
+
+    def _apply_channel(self, op, key, channel):
+        server_id, channel_id = key
+        if server_id is None:
+            self.private_channels = [i for i in self.private_channels if i.id != channel_id]
+            if op != REMOVED:
+                self.private_channels.append(channel)
+            return
+
+        server = self.get_server(server_id)
+        if op == REMOVED:
+            server._channels.pop(channel_id, None)
+            return
+        channel.server = server
+        server._add_channel(channel)
+
+    def _apply_member(self, op, key, member):
+        server_id, member_id = key
+        try:
+            server = self.get_server(server_id)
+        except KeyError:
+            # the server was removed before the delta arrived
+            return
+        if op == REMOVED:
+            server._members.pop(member_id, None)
+            return
+
+        local_roles = {role.id: role for role in server.roles}
+        member.server = server
+        member.roles = [local_roles.get(role.id, role) for role in member.roles]
+        server._add_member(member)
+        if member.id == server.owner_id:
+            server.owner = member
+
+    def _apply_role(self, op, key, role):
+        server_id, role_id = key
+        server = self.get_server(server_id)
+        local = next((i for i in server.roles if i.id == role_id), None)
+        if op == ADDED:
+            role.server = server
+            server._add_role(role)
+        elif op == REMOVED:
+            server._remove_role(local)
+            for member in server.members:
+                member.roles = [i for i in member.roles if i.id != role_id]
+        else:
+            # update in place, so that members keep referring to it
+            for attr in type(role).__slots__:
+                if attr != "server" and hasattr(role, attr):
+                    setattr(local, attr, getattr(role, attr))
+
+    def _apply_emojis(self, op, server_id, emojis):
+        server = self.get_server(server_id)
+        for emoji in emojis:
+            emoji.server = server
+        server.emojis = emojis
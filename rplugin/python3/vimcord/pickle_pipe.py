@@ -6,22 +6,79 @@ requests for members and methods.
 '''
 import asyncio
 import base64
+import collections
 import gzip
+import inspect
 import json
 import logging
 import pickle
+import random
+import struct
 import sys
+import time
 import traceback
+import zlib
 
 log = logging.getLogger(__name__)
 log.setLevel("DEBUG")
 
+# Wire formats understood by the pipe.
+# Connections start out using newline-separated base85 lines, which every daemon understands.
+# Clients then ask to upgrade to length-prefixed binary frames with NEGOTIATE_PATH.
+# FRAMING_STREAM frames are compressed against a zlib stream shared by the whole connection.
+FRAMING_LINES = 0
+FRAMING_BINARY = 1
+FRAMING_STREAM = 2
+SUPPORTED_FRAMINGS = (FRAMING_LINES, FRAMING_BINARY, FRAMING_STREAM)
+
+# Binary frames are a flags byte and a big-endian payload length, followed by the payload
+FRAME_HEADER = struct.Struct("!BI")
+FRAME_COMPRESSED = 0x01
+FRAME_STREAMED = 0x02
+
+# Pickles smaller than this are not worth compressing
+COMPRESSION_THRESHOLD = 512
+
+# Path used to negotiate framing. Older daemons reply to it with an "Invalid path" error.
+NEGOTIATE_PATH = ".__pipe_framing__"
+# Path used to run several queries in one request. Older daemons also reply with an error.
+BATCH_PATH = ".__pipe_batch__"
+# Paths used to tell the server which events the client has handlers for.
+# Older daemons ignore these and send every event.
+SUBSCRIBE_PATH = ".__pipe_subscribe__"
+UNSUBSCRIBE_PATH = ".__pipe_unsubscribe__"
+# Path used to cancel a request the client is no longer waiting for. Older daemons ignore it.
+CANCEL_PATH = ".__pipe_cancel__"
+# Path used to number events, and replay the ones a reconnecting client missed.
+# Older daemons reply with an error.
+RESUME_PATH = ".__pipe_resume__"
+# Path used to iterate over a remote iterable in pages. Older daemons reply with an error.
+STREAM_PATH = ".__pipe_stream__"
+
+# Events which are raised by the client protocol itself, rather than sent by the server
+LOCAL_EVENTS = ("PROTOCOL_UNKNOWN_DATA", "PROTOCOL_ERROR")
+
+# Size of a transport's write buffer at which the server starts queueing frames
+WRITE_BUFFER_LIMIT = 2**18
+# Bytes of queued frames at which a client which is not reading is disconnected
+MAX_QUEUED_BYTES = 2**24
+
+# Default number of items in each page sent by STREAM_PATH
+STREAM_PAGE_SIZE = 100
+
+# Number of events, and bytes of pickled events, kept for replaying to reconnecting clients
+JOURNAL_LENGTH = 4096
+JOURNAL_BYTES = 2**24
+
 class PicklePipeException(Exception):
     '''Exception object passed for pickling errors or invalid paths on the server object'''
 
 class ForwardedException(Exception):
     '''Exception passed when a remote await fails. Raises exception on the client.'''
 
+class PipeClosedException(Exception):
+    '''Exception raised on the client for requests which cannot complete because the pipe closed'''
+
 def decode_for_pipe(data):
     unb85 = base64.b85decode(data)
     dilute = gzip.decompress(unb85)
@@ -32,6 +89,94 @@ def encode_for_pipe(obj):
     concentrate = gzip.compress(pickled)
     return base64.b85encode(concentrate) + b"\n"
 
+class FrameCodec:
+    '''
+    Per-connection encoder and decoder for frames.
+
+    In FRAMING_STREAM, pickles at least `threshold` bytes long are compressed
+    with a zlib stream which lives as long as the connection, so names and ids
+    repeated across frames compress against the history of earlier frames.
+    Each frame is ended with a sync flush, so it can be decompressed as soon as
+    it arrives. Smaller pickles are sent as-is.
+
+    Sizes and CPU time spent are accumulated in `stats` and logged per frame.
+    '''
+    def __init__(self, framing=FRAMING_LINES, threshold=COMPRESSION_THRESHOLD):
+        self.framing = framing
+        self.threshold = threshold
+        self._compressor = zlib.compressobj()
+        self._decompressor = zlib.decompressobj()
+        self.stats = {
+            "encoded": {"frames": 0, "compressed": 0, "raw_bytes": 0, "wire_bytes": 0, "cpu_time": 0.},
+            "decoded": {"frames": 0, "compressed": 0, "raw_bytes": 0, "wire_bytes": 0, "cpu_time": 0.},
+        }
+
+    def _record(self, direction, raw_size, wire_size, compressed, start):
+        cpu_time = time.process_time() - start
+        stats = self.stats[direction]
+        stats["frames"] += 1
+        stats["compressed"] += compressed
+        stats["raw_bytes"] += raw_size
+        stats["wire_bytes"] += wire_size
+        stats["cpu_time"] += cpu_time
+        log.debug(
+            "%s frame: %d bytes pickled, %d bytes on wire (ratio %.2f) in %.3f ms",
+            direction.capitalize(),
+            raw_size,
+            wire_size,
+            wire_size / raw_size if raw_size else 1.,
+            cpu_time * 1000
+        )
+
+    def encode(self, obj):
+        '''Encode an object for writing to the pipe'''
+        if self.framing == FRAMING_LINES:
+            return encode_for_pipe(obj)
+        return self.encode_pickled(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def encode_pickled(self, pickled):
+        '''Encode an already-pickled object for writing to the pipe'''
+        if self.framing == FRAMING_LINES:
+            return base64.b85encode(gzip.compress(pickled)) + b"\n"
+
+        start = time.process_time()
+        payload = pickled
+        flags = 0
+        if self.framing == FRAMING_BINARY:
+            payload = gzip.compress(pickled)
+            flags = FRAME_COMPRESSED
+        elif len(pickled) >= self.threshold:
+            payload = self._compressor.compress(pickled) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            flags = FRAME_STREAMED
+
+        self._record("encoded", len(pickled), len(payload), bool(flags), start)
+        return FRAME_HEADER.pack(flags, len(payload)) + payload
+
+    def decode(self, framing, flags, payload):
+        '''Decode a payload read by a FrameReader'''
+        if framing == FRAMING_LINES:
+            return decode_for_pipe(payload)
+
+        start = time.process_time()
+        pickled = payload
+        if flags & FRAME_STREAMED:
+            pickled = self._decompressor.decompress(payload)
+        elif flags & FRAME_COMPRESSED:
+            pickled = gzip.decompress(payload)
+
+        self._record("decoded", len(pickled), len(payload), bool(flags), start)
+        return pickle.loads(pickled)
+
+def log_read_error(e):
+    '''Log an exception which occurred while reading from the pipe'''
+    if sys.version_info >= (3, 10):
+        stack_trace = traceback.format_exception(e)
+    elif hasattr(e, "__traceback__"):
+        stack_trace = traceback.format_exception(type(e), e, e.__traceback__)
+    else:
+        stack_trace = "(Could not get stack trace)"
+    log.error("Error %s occurred during read!\n%s", e, "".join(stack_trace))
+
 def convert_return(obj):
     '''
     Convert an object into a form suitable for pickling.
@@ -48,11 +193,78 @@ def convert_return(obj):
         pass
     return obj
 
+async def _iterate_async(iterable):
+    for item in iterable:
+        yield item
+
+class FrameReader:
+    '''
+    Incremental reader for data received over the pipe.
+
+    Received data is appended to a single buffer and complete frames are handed
+    out as memoryview slices of it, so partial reads are never re-joined or
+    re-split. Consumed data is dropped from the front of the buffer once all
+    complete frames have been read.
+
+    The framing can be changed between frames (for example, after negotiation),
+    in which case the remaining data is read using the new framing.
+    '''
+    def __init__(self):
+        self.framing = FRAMING_LINES
+        self._buffer = bytearray()
+        self._offset = 0
+        # in line mode, the position up to which we know there are no newlines
+        self._scanned = 0
+
+    def feed(self, data):
+        self._buffer += data
+
+    def _next_span(self):
+        '''Get (start, end, flags) of the next complete frame, or None if there is none'''
+        if self.framing == FRAMING_LINES:
+            newline = self._buffer.find(b"\n", max(self._offset, self._scanned))
+            if newline < 0:
+                self._scanned = len(self._buffer)
+                return None
+            start = self._offset
+            self._offset = self._scanned = newline + 1
+            return start, newline, 0
+
+        if len(self._buffer) - self._offset < FRAME_HEADER.size:
+            return None
+        flags, length = FRAME_HEADER.unpack_from(self._buffer, self._offset)
+        start = self._offset + FRAME_HEADER.size
+        end = start + length
+        if end > len(self._buffer):
+            return None
+        self._offset = end
+        return start, end, flags
+
+    def frames(self):
+        '''
+        Generator over complete frames, as triples of the framing they were
+        read with, their flags, and a memoryview of their payload.
+        The memoryview is only valid until the next frame is requested.
+        '''
+        while (span := self._next_span()) is not None:
+            start, end, flags = span
+            if start == end:
+                continue
+            with memoryview(self._buffer) as view, view[start:end] as payload:
+                yield self.framing, flags, payload
+
+        if self._offset:
+            del self._buffer[:self._offset]
+            self._scanned = max(self._scanned - self._offset, 0)
+            self._offset = 0
+
 class PickleServerProtocol(asyncio.Protocol):
     '''
     Small server protocol which can respond to queries based on a reference
     object provided. Can also emit server-side events.
-    Queries and responses are gzipped pickles encoded in base64.
+    Queries and responses are pickles, either gzipped and encoded in base85 on
+    separate lines, or in length-prefixed binary frames if the client requested
+    them with NEGOTIATE_PATH.
 
     Queries are of the form `[request_id, path, *args]`, where path is a period
     (.)-separated sequence of names which are iteratively applied to the base
@@ -65,108 +277,255 @@ class PickleServerProtocol(asyncio.Protocol):
     result of the query.
 
     Events are of the form `["event", event_name, *data]`, where data comes from
-    the event handler.
+    the event handler. Once the client subscribes to an event with
+    SUBSCRIBE_PATH, only events it has subscribed to are sent. Once the
+    client sends RESUME_PATH, events are instead of the form
+    `["event_seq", sequence, event_name, *data]`.
     '''
-    def __init__(self, obj):
+    def __init__(self, obj, broadcaster=None):
         self.transport = None
         self.reference_object = obj
+        self.broadcaster = broadcaster
 
-        self._prev = b""
+        self._reader = FrameReader()
+        self._codec = FrameCodec()
+        # events the client has handlers for. None until the client subscribes, meaning all events
+        self._subscriptions = None
+        # whether events are sent with their sequence number
+        self.sequenced = False
+        # tasks replying to requests, by request id, so that the client can cancel them
+        self._replies = {}
+        # frames waiting for the transport's write buffer to drain
+        self._outbound = collections.deque()
+        self._outbound_bytes = 0
+        self._paused = False
 
     def connection_made(self, transport):
         '''Process communication initiated. Save transport and send connected event.'''
         self.transport = transport
+        transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+        if self.broadcaster is not None:
+            self.broadcaster.attach(self)
         log.info("Connected!")
 
     def data_received(self, data):
         '''Reply to data request with pickle'''
-        lines = data.split(b"\n")
-        hold = b""
-        if data[-1] != ord("\n"):
-            hold = lines[-1]
-            lines = lines[:-1]
-
-        for i in lines:
+        self._reader.feed(data)
+        for framing, flags, payload in self._reader.frames():
             try:
-                if not i.rstrip(): return
-                unpickled = decode_for_pipe(self._prev + i)
-                self._prev = b""
-                asyncio.get_event_loop().create_task(self._reply(unpickled))
+                unpickled = self._codec.decode(framing, flags, payload)
+                if unpickled[1] == NEGOTIATE_PATH:
+                    self._negotiate(unpickled)
+                    continue
+                if unpickled[1] in (SUBSCRIBE_PATH, UNSUBSCRIBE_PATH):
+                    self._subscribe(unpickled)
+                    continue
+                if unpickled[1] == CANCEL_PATH:
+                    self._cancel(unpickled)
+                    continue
+                if unpickled[1] == RESUME_PATH:
+                    self._resume(unpickled)
+                    continue
+                task = asyncio.get_event_loop().create_task(self._reply(unpickled))
+                if unpickled[0] != -1:
+                    self._replies[unpickled[0]] = task
+                    task.add_done_callback(lambda _, request_id=unpickled[0]: \
+                        self._replies.pop(request_id, None))
             except Exception as e:
-                if sys.version_info >= (3, 10):
-                    stack_trace = traceback.format_exception(e)
-                elif hasattr(e, "__traceback__"):
-                    stack_trace = traceback.format_exception(type(e), e, e.__traceback__)
-                else:
-                    stack_trace = "(Could not get stack trace)"
-                log.error(
-                    "Error %s occurred during read!\n%s",
-                    e,
-                    "".join(stack_trace)
-                )
-
-        if hold != b"":
-            self._prev = self._prev + hold
+                log_read_error(e)
+
+    def _negotiate(self, unpickled):
+        '''
+        Reply to a framing request, then switch to the framing requested.
+        This is done synchronously, so that any data after the request is read correctly.
+        '''
+        request_id, _, (args, _) = unpickled
+        if args and args[0] not in SUPPORTED_FRAMINGS:
+            log.error("Client requested unknown framing %r", args[0])
+            self.write([request_id], [PicklePipeException(f"Unknown framing: {args[0]!r}")])
+            return
+        # use the best framing we support which the client also supports
+        framing = args[0] if args else FRAMING_LINES
+        self.write([request_id], [framing])
+        self._codec.framing = self._reader.framing = framing
+        log.info("Using framing %d", framing)
+
+    def _subscribe(self, unpickled):
+        '''Add or remove events from those the client wants to receive'''
+        _, verb, ((event_names,), _) = unpickled
+        if self._subscriptions is None:
+            self._subscriptions = set()
+        if verb == SUBSCRIBE_PATH:
+            changed = set(event_names) - self._subscriptions
+            self._subscriptions.update(changed)
+            if self.broadcaster is not None:
+                self.broadcaster.subscribe(changed)
+        else:
+            changed = self._subscriptions.intersection(event_names)
+            self._subscriptions.difference_update(changed)
+            if self.broadcaster is not None:
+                self.broadcaster.unsubscribe(changed)
+        log.info("Client is subscribed to events %s", self._subscriptions)
+
+    def _resume(self, unpickled):
+        '''
+        Start numbering events, then replay the events after the position the
+        client gives, if the journal still has all of them.
+        This is done synchronously, so that no events are sent between the replay and the reply.
+        '''
+        request_id, _, ((position,), _) = unpickled
+        self.sequenced = True
+        if self.broadcaster is None:
+            self.write([request_id], [[False, None, 0]])
+            return
+
+        replay = self.broadcaster.journal_since(position)
+        self.write([request_id], [[
+            replay is not None,
+            self.broadcaster.epoch,
+            self.broadcaster.sequence
+        ]])
+        for _, event_name, pickled in replay or []:
+            if self.wants_event(event_name):
+                self.send_frame(self._codec.encode_pickled(pickled))
+        log.info("Client resumed from %s", position)
+
+    def _cancel(self, unpickled):
+        '''Cancel the reply to a request which the client has given up on'''
+        _, _, ((request_id,), _) = unpickled
+        if (task := self._replies.pop(request_id, None)) is not None:
+            log.info("Cancelling request %d", request_id)
+            task.cancel()
+
+    def wants_event(self, event_name):
+        '''Whether the client should be sent events named `event_name`'''
+        return self._subscriptions is None or event_name in self._subscriptions
 
     def connection_lost(self, exc):
         '''Process communication closed. Call close event.'''
+        # replies still running are left to finish, since they may be shared
+        # daemon state (e.g., the Discord connection)
         self.transport = None
+        self._replies.clear()
+        self._outbound.clear()
+        self._outbound_bytes = 0
+        if self.broadcaster is not None:
+            self.broadcaster.detach(self)
         log.error("Connection lost! %s", exc)
 
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+
+    def _flush(self):
+        '''Write queued frames until the transport's buffer fills up again'''
+        while self._outbound and not self._paused and self.transport is not None:
+            frame = self._outbound.popleft()
+            self._outbound_bytes -= len(frame)
+            self.transport.write(frame)
+
+    def send_frame(self, frame):
+        '''
+        Write an encoded frame, or queue it if the client is not keeping up.
+        Frames are always sent in the order they were encoded, which the client
+        needs to decompress FRAMING_STREAM frames.
+        '''
+        if self.transport is None or self.transport.is_closing():
+            return
+        if not self._paused and not self._outbound \
+                and self.transport.get_write_buffer_size() < WRITE_BUFFER_LIMIT:
+            self.transport.write(frame)
+            return
+
+        self._outbound.append(frame)
+        self._outbound_bytes += len(frame)
+        if self._outbound_bytes > MAX_QUEUED_BYTES:
+            log.error(
+                "Client has %d bytes of unread frames. Disconnecting it.",
+                self._outbound_bytes
+            )
+            self._outbound.clear()
+            self._outbound_bytes = 0
+            self.transport.abort()
+
     def write(self, base, args):
         if self.transport is not None:
             try:
-                self.transport.write(encode_for_pipe(base + args))
+                self.send_frame(self._codec.encode(base + args))
             except pickle.PicklingError:
                 formatted = f"Could not pickle {args}!"
                 log.error(formatted)
-                self.transport.write(encode_for_pipe(base + [PicklePipeException(formatted)]))
+                self.send_frame(self._codec.encode(base + [PicklePipeException(formatted)]))
 
     def write_error(self, exc):
         '''Write an exception's type and message to the pipe, fewer questions asked'''
         self.write(["event", "error"], [type(exc), str(exc)])
 
+    def _resolve_path(self, verb):
+        '''getattr on the reference object until we're at the member or method we want'''
+        base = self.reference_object
+        for fragment in verb.split(".")[1:]:
+            base = getattr(base, fragment)
+        return base
+
     async def _reply(self, unpickled):
         request_id, verb, data = unpickled
         args, kwargs = data
 
-        # getattrs until we're at the method we want
-        base = self.reference_object
-        path = verb.split(".")[1:]
+        if request_id != -1:
+            if verb == BATCH_PATH:
+                ret = await self._run_batch(*args)
+            elif verb == STREAM_PATH:
+                await self._run_stream(request_id, *args)
+                return
+            else:
+                ret = await self._run_path(verb, args, kwargs)
+            self.write([request_id], [ret])
+            return
+
         try:
-            for fragment in path:
-                base = getattr(base, fragment)
+            base = self._resolve_path(verb)
         except AttributeError:
             log.error("Received path for invalid path: %s", verb)
             self.write([request_id], [PicklePipeException(f"Invalid path: {verb}!")])
             return
 
-        if request_id == -1:
-            if asyncio.iscoroutinefunction(base):
-                log.info("Creating task for coroutine %s", base)
-                asyncio.get_event_loop().create_task(base(*args, **kwargs))
-            else:
-                log.info("Creating task for method %s", base)
-                asyncio.get_event_loop().call_soon(base, *args, **kwargs)
-                # log.error("Requested path (%s) is not a coroutine function!", verb)
-                # self.write(
-                #     [request_id],
-                #     [PicklePipeException("Requested path is not a coroutine function!")]
-                # )
-            return
+        if asyncio.iscoroutinefunction(base):
+            log.info("Creating task for coroutine %s", base)
+            asyncio.get_event_loop().create_task(base(*args, **kwargs))
+        else:
+            log.info("Creating task for method %s", base)
+            asyncio.get_event_loop().call_soon(base, *args, **kwargs)
+            # log.error("Requested path (%s) is not a coroutine function!", verb)
+            # self.write(
+            #     [request_id],
+            #     [PicklePipeException("Requested path is not a coroutine function!")]
+            # )
+
+    async def _run_path(self, verb, args, kwargs):
+        '''
+        Get the member at a path, or the result of calling the method there, converted for pickling.
+        Errors are returned rather than raised, so that they can be forwarded to the client.
+        '''
+        try:
+            base = self._resolve_path(verb)
+        except AttributeError:
+            log.error("Received path for invalid path: %s", verb)
+            return PicklePipeException(f"Invalid path: {verb}!")
 
         if not callable(base):
             log.info("Got member %s", verb)
-            self.write([request_id], [convert_return(base)])
-            return
+            return convert_return(base)
 
         log.info("Running method %s", verb)
         try:
             ret = base(*args, **kwargs)
         except Exception as e:
             log.info("Caught error when fetching method!")
-            self.write([request_id], [convert_return(e)])
-            return
+            return convert_return(e)
 
         if asyncio.iscoroutine(ret):
             log.info("Awaiting coroutine")
@@ -174,35 +533,246 @@ class PickleServerProtocol(asyncio.Protocol):
                 ret = await ret
             except Exception as e:
                 log.info("Caught error when awaiting method!")
-                self.write([request_id], [convert_return(e)])
-                return
+                return convert_return(e)
+
+        return convert_return(ret)
+
+    async def _run_batch(self, calls):
+        '''Run a list of queries concurrently. Returns a list of their results, in order.'''
+        log.info("Running batch of %d queries", len(calls))
+        return list(await asyncio.gather(*[
+            self._run_path(verb, args, kwargs) for verb, args, kwargs in calls
+        ]))
+
+    async def _run_stream(self, request_id, verb, args, kwargs, page_size):
+        '''
+        Send the items of the iterable (or async iterable) at a path, or returned
+        by calling the method there, in pages of `page_size` items.
+        Pages are of the form `["stream", request_id, items, more]`, and errors
+        are sent in place of `items`.
+        '''
+        try:
+            items = self._resolve_path(verb)
+        except AttributeError:
+            log.error("Received path for invalid path: %s", verb)
+            self.write(["stream", request_id], [PicklePipeException(f"Invalid path: {verb}!"), False])
+            return
+
+        log.info("Streaming %s", verb)
+        try:
+            if callable(items):
+                items = items(*args, **kwargs)
+            if inspect.isawaitable(items):
+                items = await items
+            if not hasattr(items, "__aiter__"):
+                items = _iterate_async(items)
 
-        self.write([request_id], [convert_return(ret)])
+            page = []
+            async for item in items:
+                page.append(item)
+                if len(page) >= page_size:
+                    self.write(["stream", request_id], [page, True])
+                    page = []
+                    # let events and other replies through between pages
+                    await asyncio.sleep(0)
+            self.write(["stream", request_id], [page, False])
+        except Exception as e:
+            log.info("Caught error when streaming %s!", verb)
+            self.write(["stream", request_id], [convert_return(e), False])
 
     def get_event_handler(self, event_name):
         async def event_handler(*data):
-            self.write(["event", event_name], list(data))
+            if self.wants_event(event_name):
+                self.write(["event", event_name], list(data))
+        return event_handler
+
+class EventBroadcaster:
+    '''
+    Sends events to every attached PickleServerProtocol which has subscribed to them.
+
+    Each event is pickled once, no matter how many clients are attached.
+    The lines and binary framings compress frames independently, so a frame
+    encoded for one client is reused for every other client with that framing.
+    FRAMING_STREAM has a compression stream per connection, so the shared
+    pickle is compressed separately for each of those clients.
+
+    Events are numbered, and the latest ones any client has subscribed to are
+    kept in a journal. Reconnecting clients can then be sent only the events
+    they missed. Positions in the journal are `(epoch, sequence)`, where the
+    epoch changes whenever the daemon restarts.
+
+    Events stay journaled after the last client subscribed to them disconnects,
+    until the events after it left are evicted and it could no longer be
+    replayed everything it missed anyway.
+    '''
+    def __init__(self, journal_length=JOURNAL_LENGTH, journal_bytes=JOURNAL_BYTES):
+        self.protocols = []
+
+        self.epoch = f"{random.getrandbits(64):016x}"
+        self.sequence = 0
+        self.journaled_events = set()
+        # number of attached clients subscribed to each event
+        self._subscribers = collections.Counter()
+        # events with no subscribers left -> sequence when the last one disconnected
+        self._held = {}
+        self.journal_length = journal_length
+        self.journal_bytes = journal_bytes
+        # (sequence, event_name, pickled event) of the latest events
+        self._journal = collections.deque()
+        self._journal_size = 0
+
+    def attach(self, protocol):
+        if protocol not in self.protocols:
+            self.protocols.append(protocol)
+
+    def detach(self, protocol):
+        if protocol in self.protocols:
+            self.protocols.remove(protocol)
+            self.unsubscribe(protocol._subscriptions or (), hold=True)
+
+    def subscribe(self, event_names):
+        '''Start journaling events that a newly subscribed client wants'''
+        for event_name in event_names:
+            self._subscribers[event_name] += 1
+            self._held.pop(event_name, None)
+            self.journaled_events.add(event_name)
+
+    def unsubscribe(self, event_names, hold=False):
+        '''
+        Stop journaling events that no subscribed client wants. If `hold`, they are
+        kept until the client which left can no longer resume.
+        '''
+        for event_name in event_names:
+            self._subscribers[event_name] -= 1
+            if self._subscribers[event_name] > 0:
+                continue
+            del self._subscribers[event_name]
+            if hold:
+                self._held[event_name] = self.sequence
+            else:
+                self.journaled_events.discard(event_name)
+
+    def journal_since(self, position):
+        '''
+        Get the journaled events after `position`, or None if some of them are
+        no longer in the journal (or are from before the daemon restarted).
+        '''
+        if position is None:
+            return []
+        epoch, sequence = position
+        if epoch != self.epoch or sequence > self.sequence:
+            return None
+        oldest = self._journal[0][0] if self._journal else self.sequence + 1
+        if sequence + 1 < oldest:
+            return None
+        return [entry for entry in self._journal if entry[0] > sequence]
+
+    def _record(self, event_name, pickled):
+        self._journal.append((self.sequence, event_name, pickled))
+        self._journal_size += len(pickled)
+        while len(self._journal) > self.journal_length or self._journal_size > self.journal_bytes:
+            _, _, dropped = self._journal.popleft()
+            self._journal_size -= len(dropped)
+        if self._held and self._journal:
+            self._release_held(self._journal[0][0])
+
+    def _release_held(self, oldest):
+        '''Stop journaling held events once the clients which wanted them cannot resume'''
+        for event_name, left_at in list(self._held.items()):
+            if left_at + 1 < oldest:
+                del self._held[event_name]
+                self.journaled_events.discard(event_name)
+
+    def broadcast(self, event_name, data):
+        '''Write event `event_name` with `data` to all subscribed clients'''
+        targets = [
+            protocol for protocol in self.protocols
+            if protocol.transport is not None and protocol.wants_event(event_name)
+        ]
+        journaled = event_name in self.journaled_events
+        if not targets and not journaled:
+            return
+        self.sequence += 1
+
+        # pickled once in each form that some client needs
+        pickles = {}
+        def pickled_as(sequenced):
+            if sequenced not in pickles:
+                base = ["event_seq", self.sequence] if sequenced else ["event"]
+                try:
+                    pickles[sequenced] = pickle.dumps(
+                        [*base, event_name, *data],
+                        protocol=pickle.HIGHEST_PROTOCOL
+                    )
+                except pickle.PicklingError:
+                    formatted = f"Could not pickle {data}!"
+                    log.error(formatted)
+                    pickles[sequenced] = pickle.dumps(
+                        [*base, event_name, PicklePipeException(formatted)]
+                    )
+            return pickles[sequenced]
+
+        if journaled:
+            self._record(event_name, pickled_as(True))
+
+        shared_frames = {}
+        for protocol in targets:
+            pickled = pickled_as(protocol.sequenced)
+            framing = protocol._codec.framing
+            if framing == FRAMING_STREAM:
+                frame = protocol._codec.encode_pickled(pickled)
+            elif (protocol.sequenced, framing) in shared_frames:
+                frame = shared_frames[protocol.sequenced, framing]
+            else:
+                frame = shared_frames[protocol.sequenced, framing] = \
+                    protocol._codec.encode_pickled(pickled)
+            protocol.send_frame(frame)
+
+    def get_event_handler(self, event_name):
+        async def event_handler(*data):
+            self.broadcast(event_name, data)
         return event_handler
 
 class PickleClientProtocol(asyncio.Protocol):
     '''
     Small client protocol for corresponding with PickleClientProtocol.
-    Queries and responses are gzipped pickles encoded in base64.
+    Queries and responses are pickles, using the framing agreed on in `negotiate`.
 
     Supports asynchronous queries to the server with `wait_for`, with the
     path provided as the first argument and remaining arguments as arguments to
-    the server method.
+    the server method. Several queries can be made in one round trip with
+    `wait_for_many`. Remote iterables can be read a page at a time with `iterate`.
+
+    Queries which time out or are cancelled are also cancelled on the server.
+    When the connection is lost, queries still waiting raise PipeClosedException.
 
-    Can bind events from the server to callbacks with signature (*data)
+    Can bind events from the server to callbacks with signature (*data).
+    The server is only asked to send events which have callbacks bound.
+    After `resume`, events are numbered, so that a later connection can
+    `resume` from `journal_position` and receive only the events it missed.
     '''
     def __init__(self):
         self.transport = None
-        self._prev = b""
+        self._reader = FrameReader()
+        self._codec = FrameCodec()
+        self._negotiation_id = None
 
         self._events = {}
+        # epoch of the server's event journal, and the number of the last event received
+        self._epoch = None
+        self._event_sequence = 0
+        # request id of a `resume` awaiting its reply, and the events received meanwhile
+        self._resume_id = None
+        self._held_events = []
 
         self._waiting_property = {}
+        # queues of pages for `iterate`, by request id
+        self._streams = {}
         self._request_number = 0
+        self._batch_supported = True
+        self.stream_page_size = STREAM_PAGE_SIZE
+        # timeout for queries made with `wait_for`, in seconds, or None to wait forever
+        self.request_timeout = None
 
     def connection_made(self, transport):
         '''Process communication initiated; save transport.'''
@@ -213,17 +783,10 @@ class PickleClientProtocol(asyncio.Protocol):
         Split out received data into individual pickles.
         Respond to events and waiting data.
         '''
-        lines = data.split(b"\n")
-        hold = b""
-        if data[-1] != ord("\n"):
-            hold = lines[-1]
-            lines = lines[:-1]
-
-        for i in lines:
+        self._reader.feed(data)
+        for framing, flags, payload in self._reader.frames():
             try:
-                if not i.rstrip(): continue
-                unpickle = decode_for_pipe(self._prev + i)
-                self._prev = b""
+                unpickle = self._codec.decode(framing, flags, payload)
                 # got bad data
                 if not isinstance(unpickle, list) or len(unpickle) < 2:
                     self._call_event("PROTOCOL_UNKNOWN_DATA", unpickle)
@@ -233,31 +796,107 @@ class PickleClientProtocol(asyncio.Protocol):
 
                 # actually handle the data
                 # events
+                if unpickle[0] == "event_seq":
+                    self._event_sequence = max(self._event_sequence, unpickle[1])
+                    unpickle = unpickle[1:]
+                    unpickle[0] = "event"
                 if unpickle[0] == "event":
                     if len(unpickle) >= 3 and isinstance(unpickle[2], PicklePipeException):
                         self._call_event("PROTOCOL_ERROR", unpickle[1])
                         log.error("Protocol error occurred! %s", unpickle[2])
                         continue
+                    if self._resume_id is not None:
+                        self._held_events.append((unpickle[1], unpickle[2:]))
+                        continue
                     self._call_event(unpickle[1], unpickle[2:])
+                elif unpickle[0] == "stream":
+                    if (stream := self._streams.get(unpickle[1])) is not None:
+                        stream.put_nowait(unpickle[2:])
+                elif (stream := self._streams.get(unpickle[0])) is not None:
+                    # older servers reply to STREAM_PATH like any other request, with an error
+                    stream.put_nowait([unpickle[1], False])
                 elif (waiting_future := self._waiting_property.get(unpickle[0])) is not None:
+                    # the replay follows the reply immediately, so held events are handled first
+                    if unpickle[0] == self._resume_id:
+                        self._end_resume(unpickle[1])
                     if isinstance(unpickle[1], (PicklePipeException, ForwardedException)):
                         waiting_future.set_exception(unpickle[1])
                         continue
+                    # the server switches framing immediately after replying, so we must too
+                    if unpickle[0] == self._negotiation_id:
+                        self._codec.framing = self._reader.framing = unpickle[1]
                     waiting_future.set_result(unpickle[1])
             except Exception as e:
-                if sys.version_info >= (3, 10):
-                    stack_trace = traceback.format_exception(e)
-                elif hasattr(e, "__traceback__"):
-                    stack_trace = traceback.format_exception(type(e), e, e.__traceback__)
-                else:
-                    stack_trace = "(Could not get stack trace)"
-                log.error("Error %s occurred during read!\n%s", e, "".join(stack_trace))
-
-        if hold != b"":
-            self._prev += hold
+                log_read_error(e)
 
     def connection_lost(self, exc):
-        '''Process communication closed. Call close event.'''
+        '''Process communication closed. Fail all queries still waiting for a response.'''
+        self.transport = None
+        for future in self._waiting_property.values():
+            if not future.done():
+                future.set_exception(PipeClosedException("Connection to server lost!"))
+        self._waiting_property.clear()
+        for stream in self._streams.values():
+            stream.put_nowait([PipeClosedException("Connection to server lost!"), False])
+
+    async def negotiate(self, framing=FRAMING_STREAM):
+        '''
+        Ask the server to switch to a different framing.
+        This should be done before any other requests are made.
+        Returns the framing in use afterward.
+        '''
+        self._negotiation_id = self._request_number
+        try:
+            await self.wait_for(NEGOTIATE_PATH, framing)
+        except PicklePipeException:
+            log.info("Server does not support framing negotiation")
+        finally:
+            self._negotiation_id = None
+        return self._codec.framing
+
+    async def resume(self, position=None):
+        '''
+        Ask the server to number the events it sends, and to replay the events
+        after `position` (the `journal_position` of an earlier connection).
+        Events should be bound first, since only those are replayed.
+
+        Returns whether the server had all the events which were missed.
+        If not, any state kept from the earlier connection should be refetched.
+
+        Events sent before the server handles the request are also in the replay,
+        so they are held until the reply, and dropped if the replay has them.
+        '''
+        if position is not None:
+            self._resume_id = self._request_number
+        try:
+            covered, epoch, sequence = await self.wait_for(RESUME_PATH, position)
+        except PicklePipeException:
+            log.info("Server does not keep an event journal")
+            return False
+        finally:
+            if self._resume_id is not None:
+                # no reply arrived, so nothing will be replayed
+                self._end_resume(None)
+        self._epoch = epoch
+        self._event_sequence = max(self._event_sequence, sequence)
+        return covered and position is not None
+
+    def _end_resume(self, reply):
+        '''Stop holding events, dispatching those held unless the server is replaying them'''
+        held, self._held_events = self._held_events, []
+        self._resume_id = None
+        if isinstance(reply, list) and reply[0]:
+            log.info("Dropping %d events which are replayed", len(held))
+            return
+        for event_name, args in held:
+            self._call_event(event_name, args)
+
+    @property
+    def journal_position(self):
+        '''Position in the server's event journal of the last event received, if events are numbered'''
+        if self._epoch is None:
+            return None
+        return (self._epoch, self._event_sequence)
 
     def _call_event(self, event_name, args):
         '''Run event callbacks for the events registered to event_name'''
@@ -269,38 +908,153 @@ class PickleClientProtocol(asyncio.Protocol):
         Bind event `handler` to event `event_name`.
         Handler should have matching arguments to the event emitted by the server.
         '''
-        if event_name not in self._events:
-            self._events[event_name] = []
-
         if not asyncio.iscoroutinefunction(handler):
             raise TypeError("Handled function must be coroutine!")
 
+        if event_name not in self._events:
+            self._events[event_name] = []
+            self._update_subscription(SUBSCRIBE_PATH, event_name)
+
         self._events[event_name].append(handler)
 
+    def remove_event(self, event_name, handler):
+        '''
+        Unbind event `handler` from event `event_name`.
+        When no handlers remain, the server stops sending the event.
+        '''
+        handlers = self._events.get(event_name, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers and event_name in self._events:
+            del self._events[event_name]
+            self._update_subscription(UNSUBSCRIBE_PATH, event_name)
+
+    def _update_subscription(self, verb, event_name):
+        if event_name in LOCAL_EVENTS or self.transport is None:
+            return
+        self.transport.write(self._codec.encode([-1, verb, [([event_name],), {}]]))
+
     async def wait_for(self, action, *args, **kwargs):
         '''
         Request remote data from the server's reference object.
         The remote data can be a method, in which case it will be called with (*args)
         '''
+        return await self._request(action, args, kwargs, self.request_timeout)
+
+    async def _request(self, action, args, kwargs, timeout):
+        if self.transport is None:
+            raise PipeClosedException("Not connected to server!")
+
         log.info("Starting await for %s", action)
-        self.transport.write(encode_for_pipe([
-            self._request_number,
+        request_id = self._request_number
+        self._request_number += 1
+        self.transport.write(self._codec.encode([
+            request_id,
             action,
             [ args, kwargs ]
         ]))
 
         future = asyncio.get_event_loop().create_future()
-        self._waiting_property[self._request_number] = future
+        self._waiting_property[request_id] = future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            log.info("Cancelling request %d for %s", request_id, action)
+            if self.transport is not None:
+                self.transport.write(self._codec.encode([-1, CANCEL_PATH, [(request_id,), {}]]))
+            raise
+        finally:
+            self._waiting_property.pop(request_id, None)
+
+    async def wait_for_many(self, *calls, return_exceptions=False, timeout=None):
+        '''
+        Request several pieces of remote data in a single round trip.
+        Calls are built with `call`, in the same way as with `awaitable`:
+
+            user, servers = await protocol.wait_for_many(
+                protocol.call.user(),
+                protocol.call.servers(),
+            )
+
+        The server runs the queries concurrently. Results are returned in the
+        same order as the calls. Like `asyncio.gather`, the first error is
+        raised unless `return_exceptions` is true. If `timeout` is given, it
+        applies to each round trip.
+        '''
+        if timeout is None:
+            timeout = self.request_timeout
+
+        if self._batch_supported:
+            try:
+                results = await self._request(BATCH_PATH, (list(calls),), {}, timeout)
+            except PicklePipeException as e:
+                # only older daemons, which do not know the path, stop us batching
+                if not str(e).startswith("Invalid path"):
+                    if not return_exceptions:
+                        raise
+                    return [e] * len(calls)
+                log.info("Server does not support batches; falling back to individual requests")
+                self._batch_supported = False
+            else:
+                for result in results:
+                    if isinstance(result, (PicklePipeException, ForwardedException)) \
+                    and not return_exceptions:
+                        raise result
+                return results
+
+        results = []
+        for action, args, kwargs in calls:
+            try:
+                results.append(await self._request(action, args, kwargs, timeout))
+            except (PicklePipeException, ForwardedException) as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    async def iterate(self, action, *args, **kwargs):
+        '''
+        Iterate over pages (lists) of items from a remote iterable, generator
+        or async generator. The path and arguments are the same as `wait_for`.
+        The server sends pages as soon as they're ready, without waiting for the
+        client to ask for the next one. Stopping early cancels the remote iteration.
+        '''
+        if self.transport is None:
+            raise PipeClosedException("Not connected to server!")
+
+        log.info("Starting stream for %s", action)
+        request_id = self._request_number
         self._request_number += 1
+        stream = asyncio.Queue()
+        self._streams[request_id] = stream
+        self.transport.write(self._codec.encode([
+            request_id,
+            STREAM_PATH,
+            [ (action, args, kwargs, self.stream_page_size), {} ]
+        ]))
 
-        return await future
+        more = True
+        try:
+            while more:
+                page, more = await stream.get()
+                if isinstance(page, (PicklePipeException, ForwardedException, PipeClosedException)):
+                    raise page
+                yield page
+        finally:
+            del self._streams[request_id]
+            if more and self.transport is not None:
+                log.info("Cancelling stream %d for %s", request_id, action)
+                self.transport.write(self._codec.encode([-1, CANCEL_PATH, [(request_id,), {}]]))
 
     def create_remote_task(self, action, *args, **kwargs):
         '''
         Start a task on the remote server, without waiting for any results
         '''
+        if self.transport is None:
+            raise PipeClosedException("Not connected to server!")
+
         log.info("Spawning remote task %s", action)
-        self.transport.write(encode_for_pipe([
+        self.transport.write(self._codec.encode([
             -1,
             action,
             [ args, kwargs ]
@@ -310,14 +1064,28 @@ class PickleClientProtocol(asyncio.Protocol):
     def awaitable(self):
         return PathBuilder(self.wait_for)
 
+    def awaitable_within(self, timeout):
+        '''Like `awaitable`, but raise asyncio.TimeoutError if there is no response in `timeout` seconds'''
+        return PathBuilder(lambda action, *args, **kwargs: \
+            self._request(action, args, kwargs, timeout))
+
+    @property
+    def stream(self):
+        return PathBuilder(self.iterate)
+
     @property
     def task(self):
         return PathBuilder(self.create_remote_task)
 
+    @property
+    def call(self):
+        return PathBuilder(lambda action, *args, **kwargs: (action, args, kwargs))
+
 class PathBuilder:
     '''
     Path builder for pickle client/server interactions.
-    Makes invoking `wait_for` and `create_remote_task` easier.
+    Makes invoking `wait_for` and `create_remote_task` (and building calls
+    for `wait_for_many`) easier.
     '''
     def __init__(self, func):
         self._path = ""